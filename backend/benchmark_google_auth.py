@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark MongoDB round trips made by /auth/google
+
+Counts the commands the handler sends to MongoDB for a brand new user and for
+a returning user, then times repeated returning-user logins.
+Requires the MongoDB instance configured in main.py.
+
+Before the find_one_and_update rewrite both cases took 6 round trips:
+  new user:       find, insert, count, update_many, insert, find
+  returning user: find, update, find, count, update_many, insert
+"""
+
+import asyncio
+import time
+import uuid
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+counter = CommandCounter()
+# Register before importing main so its Motor client picks the listener up
+monitoring.register(counter)
+
+import main  # noqa: E402
+
+
+async def count_round_trips(label, payload):
+    """Run one login and print the commands issued before the response was ready"""
+    counter.commands.clear()
+    await main.google_auth(payload)
+    commands = list(counter.commands)
+    # Let the background session archive finish so it is reported separately
+    await asyncio.sleep(0.2)
+    background = counter.commands[len(commands):]
+    print(f"{label}: {len(commands)} round trips ({', '.join(commands)})")
+    if background:
+        print(f"  + {len(background)} in background ({', '.join(background)})")
+
+
+async def main_benchmark(iterations=200):
+    print("Benchmarking /auth/google round trips")
+    print("=" * 50)
+    uid = f"bench-{uuid.uuid4().hex[:12]}"
+    payload = main.GoogleAuth(
+        firebase_uid=uid,
+        name="Benchmark User",
+        email=f"{uid}@example.com",
+        photo_url=None,
+    )
+
+    await main.ensure_indexes()
+    try:
+        await count_round_trips("New user", payload)
+        await count_round_trips("Returning user", payload)
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await main.google_auth(payload)
+        elapsed = time.perf_counter() - started
+        print(f"\n{iterations} returning-user logins: {elapsed * 1000 / iterations:.2f} ms avg")
+    finally:
+        # Wait for pending session archives before removing benchmark data
+        await asyncio.sleep(0.5)
+        user = await main.db.users.find_one({"firebase_uid": uid}, {"_id": 1})
+        if user:
+            await main.db.user_sessions.delete_many({"user_id": user["_id"]})
+            await main.db.user_session_history.delete_many({"user_id": user["_id"]})
+            await main.db.users.delete_one({"_id": user["_id"]})
+        print("✅ Benchmark data cleaned up")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_benchmark())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON encoding of list responses
+
+Compares the old response path (recursive serialize_object, then FastAPI's
+jsonable_encoder, then json.dumps as JSONResponse renders it) with the
+single-pass dumps_json used by MongoJSONResponse, on course, material and
+test attempt documents shaped like the ones the list routes return.
+No database is needed.
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+import main
+
+PAGE_SIZE = 500
+ROUNDS = 20
+
+
+def serialize_object(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, dict):
+        return {key: serialize_object(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [serialize_object(item) for item in obj]
+    return obj
+
+
+def legacy_encode(docs):
+    content = jsonable_encoder({"items": [serialize_object(doc) for doc in docs]})
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def fast_encode(docs):
+    return main.dumps_json({"items": docs})
+
+
+def make_course(i):
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "title": f"II PUC Physics Crash Course {i}",
+        "description": "Complete revision of the KSEEB syllabus with solved papers " * 3,
+        "instructor": "Dr. Kumar",
+        "category": "PUC",
+        "price": 499.0,
+        "duration": "12 weeks",
+        "thumbnail": f"/uploads/course_{i}.jpg",
+        "is_active": True,
+        "enrolled_students": i * 7,
+        "rating": 4.5,
+        "modules": [
+            {"title": f"Module {m}", "lessons": [f"Lesson {m}.{n}" for n in range(5)]}
+            for m in range(4)
+        ],
+        "created_at": now - timedelta(days=i),
+        "updated_at": now,
+    }
+
+
+def make_material(i):
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "title": f"CA Inter Taxation Notes {i}",
+        "description": "Chapter-wise notes with worked examples",
+        "category": "CA",
+        "subject": "Taxation",
+        "file_url": f"/uploads/material_{i}.pdf",
+        "file_size": 1048576 + i,
+        "download_count": i * 3,
+        "tags": ["ca", "inter", "taxation", "notes"],
+        "uploaded_by": ObjectId(),
+        "is_active": True,
+        "created_at": now - timedelta(hours=i),
+        "updated_at": now,
+    }
+
+
+def make_attempt(i):
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "user_id": str(ObjectId()),
+        "test_id": str(ObjectId()),
+        "answers": [{"question_id": str(ObjectId()), "selected": q % 4} for q in range(30)],
+        "score": 24,
+        "total_questions": 30,
+        "percentage": 80.0,
+        "time_taken": 1500 + i,
+        "started_at": now - timedelta(minutes=30),
+        "completed_at": now,
+    }
+
+
+def bench(name, docs):
+    assert json.loads(legacy_encode(docs)) == json.loads(fast_encode(docs))
+    results = {}
+    for label, encode in (("legacy", legacy_encode), ("dumps_json", fast_encode)):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            encode(docs)
+        results[label] = (time.perf_counter() - start) / ROUNDS * 1000
+    speedup = results["legacy"] / results["dumps_json"]
+    print(f"{name:<10} legacy {results['legacy']:8.2f} ms   "
+          f"dumps_json {results['dumps_json']:8.2f} ms   x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+    print(f"Encoder: {'orjson' if main.orjson is not None else 'json (stdlib fallback)'}")
+    print(f"{PAGE_SIZE} documents per page, mean of {ROUNDS} rounds\n")
+    bench("courses", [make_course(i) for i in range(PAGE_SIZE)])
+    bench("materials", [make_material(i) for i in range(PAGE_SIZE)])
+    bench("attempts", [make_attempt(i) for i in range(PAGE_SIZE)])
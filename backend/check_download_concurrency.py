@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for POST /downloads
+
+Fires 1,000 parallel track_download calls for one user and one material,
+then checks that exactly one user_downloads row exists, that its
+download_count is 1,000 and that the material's download_count grew by
+1,000 once the counter aggregator flushed.
+Requires the MongoDB instance configured in main.py.
+"""
+
+import asyncio
+import sys
+import time
+
+from bson import ObjectId
+
+import main
+
+PARALLEL_DOWNLOADS = 1000
+
+
+async def check_downloads(parallel=PARALLEL_DOWNLOADS):
+    print(f"Checking {parallel} parallel downloads")
+    print("=" * 50)
+    user_id = ObjectId()
+    material = {"title": "Concurrency check material", "download_count": 0, "created_at": main.datetime.utcnow()}
+    material_id = (await main.db.materials.insert_one(material)).inserted_id
+
+    await main.ensure_indexes()
+    try:
+        payload = {"material_id": str(material_id), "user_agent": "check_download_concurrency"}
+        started = time.perf_counter()
+        await asyncio.gather(*(main.track_download(dict(payload), user_id=str(user_id)) for _ in range(parallel)))
+        elapsed = time.perf_counter() - started
+        await main.counter_aggregator.flush()
+
+        rows = await main.db.user_downloads.find({"user_id": user_id, "material_id": material_id}).to_list(length=None)
+        material = await main.db.materials.find_one({"_id": material_id}, {"download_count": 1})
+        row_count = rows[0]["download_count"] if rows else 0
+
+        print(f"Tracked in {elapsed * 1000:.0f} ms")
+        print(f"user_downloads rows:        {len(rows)} (expected 1)")
+        print(f"row download_count:         {row_count} (expected {parallel})")
+        print(f"material download_count:    {material['download_count']} (expected {parallel})")
+        passed = len(rows) == 1 and row_count == parallel and material["download_count"] == parallel
+        print("✅ No duplicates, counts match" if passed else "❌ Check failed")
+        return passed
+    finally:
+        await main.db.user_downloads.delete_many({"material_id": material_id})
+        await main.db.materials.delete_one({"_id": material_id})
+        print("✅ Check data cleaned up")
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_downloads()) else 1)
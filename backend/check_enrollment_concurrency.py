@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Load check for POST /enrollments
+
+Enrolls USERS users into one course, each with TAPS concurrent requests
+(simulated double taps), all in parallel. Checks that every user has
+exactly one enrollment, that the rest were rejected as already enrolled,
+and that the course's enrolled_students (stored value plus counter
+shards) equals USERS.
+Requires the MongoDB instance configured in main.py.
+"""
+
+import asyncio
+import sys
+import time
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+import main
+
+USERS = 500
+TAPS = 3
+
+
+async def enroll(course_id, user_id):
+    try:
+        await main.enroll_user_in_course({"course_id": str(course_id)}, user_id=str(user_id))
+        return "enrolled"
+    except HTTPException as e:
+        if e.status_code == 400:
+            return "rejected"
+        raise
+
+
+async def check_enrollments(users=USERS, taps=TAPS):
+    print(f"Checking {users} users x {taps} concurrent enrollment taps")
+    print("=" * 50)
+    course = {"title": "Concurrency check course", "enrolled_students": 0, "created_at": main.datetime.utcnow()}
+    course_id = (await main.db.courses.insert_one(course)).inserted_id
+    user_ids = [ObjectId() for _ in range(users)]
+
+    await main.ensure_indexes()
+    try:
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(enroll(course_id, user_id) for user_id in user_ids for _ in range(taps)))
+        elapsed = time.perf_counter() - started
+
+        rows = await main.db.user_enrollments.count_documents({"course_id": course_id})
+        duplicates = await main.db.user_enrollments.aggregate([
+            {"$match": {"course_id": course_id}},
+            {"$group": {"_id": "$user_id", "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ]).to_list(length=None)
+        main.sharded_counters._expires_at.clear()
+        enrolled = await main.sharded_counters.transform("courses", "enrolled_students")
+        stored = await main.db.courses.find_one({"_id": course_id}, {"enrolled_students": 1})
+        counted = enrolled(stored)["enrolled_students"]
+
+        print(f"{len(outcomes)} requests in {elapsed * 1000:.0f} ms "
+              f"({elapsed * 1000 / len(outcomes):.2f} ms avg)")
+        print(f"enrolled / rejected:        {outcomes.count('enrolled')} / {outcomes.count('rejected')}")
+        print(f"enrollment rows:            {rows} (expected {users})")
+        print(f"users with duplicates:      {len(duplicates)} (expected 0)")
+        print(f"enrolled_students:          {counted} (expected {users})")
+        passed = rows == users and not duplicates and counted == users and outcomes.count("enrolled") == users
+        print("✅ No duplicates, counts match" if passed else "❌ Check failed")
+        return passed
+    finally:
+        await main.db.user_enrollments.delete_many({"course_id": course_id})
+        await main.sharded_counters.discard("courses", course_id)
+        await main.db.courses.delete_one({"_id": course_id})
+        print("✅ Check data cleaned up")
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_enrollments()) else 1)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Projection check for ?fields= combined with ?sort=
+
+Builds the projections the list routes send to MongoDB (read_projection,
+then sort_projection for the keyset sort field) and fails if any of them
+would be rejected, e.g. a parent and its sub-path both projected
+("Path collision" on MongoDB 4.4+), or if the sort field would be
+missing from the documents read.
+No database is needed.
+"""
+
+import sys
+
+import main
+
+CASES = [
+    # (collection, ?fields=, sort field)
+    ("courses", "title,rating_summary", "rating_summary.average"),
+    ("courses", "title", "rating_summary.average"),
+    ("courses", "title,rating_summary.average", "rating_summary.average"),
+    ("courses", None, "rating_summary.average"),
+    ("online_tests", "test_title,rating_summary", "rating_summary.average"),
+    ("materials", "title", "_id"),
+    ("payment_links", "amount,status", "created_at"),
+]
+
+
+def collisions(projection):
+    """Projected paths that are a sub-path of another projected path"""
+    paths = [key for key in projection or {} if key != "_id"]
+    return [path for path in paths for other in paths if path.startswith(f"{other}.")]
+
+
+def mixed(projection):
+    values = {bool(value) for key, value in (projection or {}).items() if key != "_id"}
+    return len(values) > 1
+
+
+def check_projections():
+    print("Checking list projections")
+    print("=" * 50)
+    passed = True
+    for collection_name, fields, sort_field in CASES:
+        projection = main.sort_projection(main.read_projection(collection_name, fields, for_list=True), sort_field)
+        problems = []
+        if collisions(projection):
+            problems.append(f"path collision {collisions(projection)}")
+        if mixed(projection):
+            problems.append("mixes inclusion and exclusion")
+        if sort_field != "_id" and not main.projection_includes(projection, sort_field):
+            problems.append(f"{sort_field} not read")
+        passed = passed and not problems
+        label = f"{collection_name} fields={fields!r} sort={sort_field}"
+        print(f"{'❌' if problems else '✅'} {label}: {projection} {'; '.join(problems)}")
+    print("\n✅ All projections valid" if passed else "\n❌ Invalid projection found")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_projections() else 1)
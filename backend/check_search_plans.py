@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Query plan check for /search/courses, /search/materials and /search/tests
+
+Builds each search the way the routes do (main.search_cursor), runs
+explain() on it and fails if any winning plan contains a COLLSCAN stage.
+Covers text queries with and without filters and filter-only searches.
+Requires the MongoDB instance configured in main.py.
+"""
+
+import asyncio
+import sys
+
+import main
+
+SEARCHES = [
+    ("courses", "II PUC physics", {}),
+    ("courses", "KPSC", {"category": "Competitive Exams"}),
+    ("courses", "", {"category": "PUC"}),
+    ("materials", "CA Inter taxation", {}),
+    ("materials", "notes", {"sub_category": "CA Inter", "course": "CA"}),
+    ("materials", "", {"course": "CA"}),
+    ("materials", "", {"sub_category": "CA Inter"}),
+    ("online_tests", "mock test", {}),
+    ("online_tests", "algebra", {"subject": "Mathematics", "difficulty_level": "Medium"}),
+    ("online_tests", "", {"difficulty_level": "Hard"}),
+]
+
+
+def plan_stages(plan):
+    """Every stage name in a plan tree"""
+    yield plan.get("stage")
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from plan_stages(child)
+
+
+async def check_plans():
+    print("Checking search query plans")
+    print("=" * 50)
+    await main.ensure_indexes()
+    passed = True
+    for collection_name, query, filters in SEARCHES:
+        cursor = main.search_cursor(main.db[collection_name], query, filters)
+        explain = await cursor.explain()
+        stages = [stage for stage in plan_stages(explain["queryPlanner"]["winningPlan"]) if stage]
+        ok = "COLLSCAN" not in stages
+        passed = passed and ok
+        label = f"{collection_name} q={query!r} filters={filters}"
+        print(f"{'✅' if ok else '❌'} {label}: {' <- '.join(stages)}")
+    print("\n✅ No collection scans" if passed else "\n❌ Collection scan found")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_plans()) else 1)
@@ -1,27 +1,119 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, status, BackgroundTasks
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Query, status, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from pydantic import BaseModel, EmailStr
-from bson import ObjectId
+from bson import ObjectId, Decimal128, json_util
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 import hashlib
+import heapq
+import hmac
 import jwt
+import math
 import os
 import random
 from enum import Enum
 import shutil
 import base64
+import bisect
 import json
+import re
 from urllib import request as urlrequest
 from urllib.error import HTTPError, URLError
 import asyncio
+import functools
+import gzip
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Responses are only gzip-compressed without it
+    brotli = None
+
+# JSON Encoding
+def _bson_default(obj):
+    """Encode BSON types the JSON encoder does not handle natively"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal128):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps_json(content: Any) -> bytes:
+    """Single-pass JSON encoding of documents containing ObjectId / datetime values"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_bson_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_bson_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response that encodes Mongo documents directly, with no pre-serialization pass"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+class MongoJSONRoute(APIRoute):
+    """
+    Route class returning handler results through MongoJSONResponse, so raw
+    Mongo documents skip FastAPI's jsonable_encoder traversal.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        @functools.wraps(endpoint)
+        async def encode_result(*args, **kw):
+            result = await endpoint(*args, **kw)
+            return result if isinstance(result, Response) else MongoJSONResponse(result)
+
+        super().__init__(path, encode_result, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        collections = CACHED_ROUTE_COLLECTIONS.get(self.path_format)
+        conditional = "GET" in self.methods and (collections is not None or self.path_format in CONDITIONAL_GET_ROUTES)
+
+        async def catalog_handler(request: Request) -> Response:
+            if "stream" in request.query_params or wants_ndjson(request):
+                return await handler(request)
+            key = None
+            if collections is not None and RESPONSE_CACHE_ENABLED:
+                # The key carries the collection versions read before the query runs,
+                # so a response racing a write is stored under the outdated version
+                key = response_cache.key(request, collections)
+                cached = response_cache.get(key)
+                if cached is not None:
+                    return await cached.to_response(request)
+            response = await handler(request)
+            if response.status_code != 200 or not isinstance(response, MongoJSONResponse):
+                return await compress_response(request, response)
+            entry = CachedResponse(response.body, collections or ())
+            if key is not None and response_cache.fits(entry):
+                await entry.precompress()
+                response_cache.put(key, entry)
+            return await entry.to_response(request)
+
+        async def compressing_handler(request: Request) -> Response:
+            return await compress_response(request, await handler(request))
+
+        return catalog_handler if conditional else compressing_handler
 
 # FastAPI App
-app = FastAPI(title="VIDYARTHI MITRAA API", version="1.0.0")
+app = FastAPI(title="VIDYARTHI MITRAA API", version="1.0.0", default_response_class=MongoJSONResponse)
+app.router.route_class = MongoJSONRoute
 
 # CORS
 app.add_middleware(
@@ -66,6 +158,97 @@ os.makedirs(os.path.join(UPLOAD_DIR, "questions"), exist_ok=True)
 # Simple in-memory toggle for dual-login feature
 DUAL_LOGIN_ENABLED = False
 
+# Session validation cache (per process). Entries are dropped as soon as this
+# process rotates or ends a session; the TTL bounds staleness across workers.
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "30"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "50000"))
+
+# Session last_activity is buffered in memory and written at most once per interval
+SESSION_ACTIVITY_FLUSH_SECONDS = int(os.getenv("SESSION_ACTIVITY_FLUSH_SECONDS", "60"))
+
+# View and download counters are summed in memory and flushed as one bulk_write
+# every COUNTER_FLUSH_SECONDS, or sooner once COUNTER_MAX_PENDING documents are dirty.
+# A crash loses at most one interval of increments.
+COUNTER_FLUSH_SECONDS = int(os.getenv("COUNTER_FLUSH_SECONDS", "5"))
+COUNTER_MAX_PENDING = int(os.getenv("COUNTER_MAX_PENDING", "10000"))
+
+# Hot counters (enrolled_students, attempts_count) are spread over COUNTER_SHARDS
+# documents per entity; their summed totals are cached per process for a few seconds
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", "16"))
+COUNTER_SHARD_CACHE_SECONDS = int(os.getenv("COUNTER_SHARD_CACHE_SECONDS", "5"))
+
+# Ended sessions are swept out of user_sessions into user_session_history,
+# which drops them (TTL index on ended_at) after the retention period
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "3600"))
+SESSION_SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", "1000"))
+SESSION_HISTORY_RETENTION_DAYS = int(os.getenv("SESSION_HISTORY_RETENTION_DAYS", "90"))
+
+# Dual-token mode: short-lived access tokens are validated without touching the
+# database; refresh tokens are checked against user_sessions when rotated.
+# Disabled by default so existing app builds keep receiving 30-day tokens.
+DUAL_TOKEN_MODE_ENABLED = os.getenv("DUAL_TOKEN_MODE_ENABLED", "false").lower() == "true"
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "300"))
+REFRESH_TOKEN_TTL_DAYS = int(os.getenv("REFRESH_TOKEN_TTL_DAYS", "30"))
+
+# Password hashing (PBKDF2-SHA256) runs on a bounded thread pool off the event loop
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "260000"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "200"))
+
+# Google ID-token verification for /auth/google. Firebase-issued tokens need
+# GOOGLE_JWKS_URL=https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com
+# and GOOGLE_TOKEN_ISSUERS=https://securetoken.google.com/<project-id>
+GOOGLE_TOKEN_VERIFICATION_ENABLED = os.getenv("GOOGLE_TOKEN_VERIFICATION_ENABLED", "false").lower() == "true"
+GOOGLE_JWKS_URL = os.getenv("GOOGLE_JWKS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_TOKEN_ISSUERS = [i for i in os.getenv("GOOGLE_TOKEN_ISSUERS", "accounts.google.com,https://accounts.google.com").split(",") if i]
+GOOGLE_TOKEN_AUDIENCES = [a for a in os.getenv("GOOGLE_TOKEN_AUDIENCES", "").split(",") if a]
+# Without an audience check a token minted for any other app's client ID would be accepted
+if GOOGLE_TOKEN_VERIFICATION_ENABLED and not GOOGLE_TOKEN_AUDIENCES:
+    raise RuntimeError("GOOGLE_TOKEN_VERIFICATION_ENABLED requires GOOGLE_TOKEN_AUDIENCES (the app's OAuth client IDs)")
+
+# List routes return every document unless the client asks for a page with
+# ?limit= or ?after=. Set LIST_PAGINATION_COMPAT=false to always paginate.
+LIST_PAGINATION_COMPAT = os.getenv("LIST_PAGINATION_COMPAT", "true").lower() == "true"
+LIST_DEFAULT_PAGE_SIZE = int(os.getenv("LIST_DEFAULT_PAGE_SIZE", "50"))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "500"))
+# Documents fetched per round trip when streaming NDJSON list responses
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Response cache for public catalog routes (per process). Writes made through
+# this process bump the collection version and invalidate at once; the TTL
+# bounds staleness across workers and for counter-only updates.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(4 * 1024 * 1024)))
+
+# JSON responses at least this large are gzip/brotli compressed per Accept-Encoding.
+# Cached responses keep their compressed variants, so they are compressed once.
+RESPONSE_COMPRESSION_ENABLED = os.getenv("RESPONSE_COMPRESSION_ENABLED", "true").lower() == "true"
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+# Bodies this large are compressed on a worker thread instead of the event loop
+RESPONSE_COMPRESSION_THREAD_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_THREAD_MIN_BYTES", str(64 * 1024)))
+
+# Reviews live in their own collection; detail routes embed the newest ones as
+# `feedback` for existing clients, older ones are paged through /reviews
+REVIEWS_EMBED_LIMIT = int(os.getenv("REVIEWS_EMBED_LIMIT", "20"))
+# rating_summary is maintained on every review; the reconciler rebuilds it from reviews
+RATING_RECONCILE_INTERVAL_SECONDS = int(os.getenv("RATING_RECONCILE_INTERVAL_SECONDS", "86400"))
+
+# In-memory search indexes are rebuilt periodically, which also picks up writes
+# made through other worker processes
+CATALOG_SEARCH_REBUILD_SECONDS = int(os.getenv("CATALOG_SEARCH_REBUILD_SECONDS", "600"))
+
+# /search/suggest keeps the ranked suggestions for prefixes of up to
+# SUGGEST_PRECOMPUTED_PREFIX_LENGTH characters; the index is rebuilt every
+# SUGGEST_REBUILD_SECONDS so popularity follows enrollments and downloads
+SUGGEST_MAX_RESULTS = int(os.getenv("SUGGEST_MAX_RESULTS", "10"))
+SUGGEST_PRECOMPUTED_PREFIX_LENGTH = int(os.getenv("SUGGEST_PRECOMPUTED_PREFIX_LENGTH", "2"))
+SUGGEST_REBUILD_SECONDS = int(os.getenv("SUGGEST_REBUILD_SECONDS", "600"))
+
 # Razorpay credentials (set these as environment variables in deployment)
 # RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID") // rzp_live_RD1TqHaORLWnO5
 # RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET") // R3KcI2buGSQyuD5SvM5GT6hk
@@ -151,8 +334,91 @@ def fetch_razorpay_status(payment_id: str) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Failed to fetch payment status: {str(e)}")
 
 # Helper Functions
+PASSWORD_HASH_SCHEME = "pbkdf2_sha256"
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    """
+    Blocking PBKDF2-SHA256 hash stored as pbkdf2_sha256$<iterations>$<salt>$<hash>.
+    Use password_hasher.hash() from request handlers.
+    """
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_HASH_ITERATIONS)
+    return "$".join([
+        PASSWORD_HASH_SCHEME,
+        str(PASSWORD_HASH_ITERATIONS),
+        base64.b64encode(salt).decode("ascii"),
+        base64.b64encode(digest).decode("ascii")
+    ])
+
+def verify_password(password: str, stored_hash: Optional[str]) -> bool:
+    """Blocking check against PBKDF2 hashes and legacy unsalted sha256 hex digests"""
+    if not stored_hash:
+        return False
+    if stored_hash.startswith(PASSWORD_HASH_SCHEME + "$"):
+        try:
+            _, iterations, salt, expected = stored_hash.split("$", 3)
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(salt), int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(base64.b64encode(digest).decode("ascii"), expected)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
+
+def password_needs_rehash(stored_hash: str) -> bool:
+    return not stored_hash.startswith(f"{PASSWORD_HASH_SCHEME}${PASSWORD_HASH_ITERATIONS}$")
+
+class PasswordHasher:
+    """
+    Runs hash_password / verify_password on a bounded thread pool (hashlib
+    releases the GIL during PBKDF2) so a login burst never stalls the event
+    loop. Work beyond workers + max_queue is rejected with a 503.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def _run(self, func, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, please try again")
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_seconds += time.perf_counter() - started
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, stored_hash: Optional[str]) -> bool:
+        if not stored_hash:
+            return False
+        return await self._run(verify_password, password, stored_hash)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(self.in_flight, self.workers),
+            "queue_depth": max(0, self.in_flight - self.workers),
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.total_seconds * 1000 / self.completed, 2) if self.completed else 0,
+            "iterations": PASSWORD_HASH_ITERATIONS,
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
 
 def create_jwt_token(user_id: str, session_id: str) -> str:
     payload = {
@@ -162,103 +428,605 @@ def create_jwt_token(user_id: str, session_id: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
+def create_access_token(user_id: str, session_id: str) -> str:
+    payload = {
+        "user_id": user_id,
+        "session_id": session_id,
+        "type": "access",
+        "exp": datetime.utcnow() + timedelta(seconds=ACCESS_TOKEN_TTL_SECONDS)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+def create_refresh_token(user_id: str, session_id: str) -> str:
+    payload = {
+        "user_id": user_id,
+        "session_id": session_id,
+        "type": "refresh",
+        "jti": uuid.uuid4().hex,
+        "exp": datetime.utcnow() + timedelta(days=REFRESH_TOKEN_TTL_DAYS)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+def issue_auth_tokens(user_id: str, session_id: str) -> Dict[str, Any]:
+    """Token fields for auth responses; "token" is always the bearer token for API calls"""
+    if not DUAL_TOKEN_MODE_ENABLED:
+        return {"token": create_jwt_token(user_id, session_id)}
+    return {
+        "token": create_access_token(user_id, session_id),
+        "refresh_token": create_refresh_token(user_id, session_id),
+        "expires_in": ACCESS_TOKEN_TTL_SECONDS
+    }
+
 def verify_jwt_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return {
             "user_id": payload.get("user_id"),
-            "session_id": payload.get("session_id")
+            "session_id": payload.get("session_id"),
+            "type": payload.get("type")
         }
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def _fetch_jwks(url: str) -> tuple:
+    """Blocking JWKS fetch. Returns (jwks, max_age) where max_age comes from Cache-Control"""
+    req = urlrequest.Request(url, method="GET")
+    req.add_header("Accept", "application/json")
+    with urlrequest.urlopen(req, timeout=10) as resp:
+        match = re.search(r"max-age=(\d+)", resp.headers.get("Cache-Control", ""))
+        return json.loads(resp.read().decode("utf-8")), int(match.group(1)) if match else None
+
+class JWKSCache:
+    """
+    In-memory cache of a provider's JSON Web Key Set. Honours the Cache-Control
+    max-age of the key endpoint, refreshes in the background shortly before
+    expiry, and single-flights concurrent refreshes into one fetch.
+    """
+
+    def __init__(self, url: str, refresh_margin_seconds: int = 300, default_max_age: int = 3600,
+                 min_refetch_seconds: int = 30):
+        self.url = url
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.default_max_age = default_max_age
+        self.min_refetch_seconds = min_refetch_seconds
+        self._keys: Dict[str, Any] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.fetches = 0
+        self.fetch_errors = 0
+
+    async def get_key(self, kid: Optional[str]):
+        now = time.monotonic()
+        expired = now >= self._expires_at
+        # Unknown kid usually means the provider rotated keys; refetch, but not in a tight loop
+        unknown_kid = kid not in self._keys and now - self._fetched_at >= self.min_refetch_seconds
+        if expired or unknown_kid:
+            try:
+                await asyncio.shield(self._start_refresh())
+            except Exception as e:
+                # Keep serving the previous key set if the provider is briefly unreachable
+                if kid not in self._keys:
+                    raise HTTPException(status_code=503, detail=f"Unable to fetch signing keys: {str(e)}")
+        elif now >= self._expires_at - self.refresh_margin_seconds:
+            self._start_refresh()
+
+        key = self._keys.get(kid)
+        if key is None:
+            raise HTTPException(status_code=401, detail="Unknown token signing key")
+        return key
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_error)
+        return self._refresh_task
+
+    async def _refresh(self):
+        self.fetches += 1
+        jwks, max_age = await asyncio.to_thread(_fetch_jwks, self.url)
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            try:
+                keys[jwk["kid"]] = jwt.PyJWK(jwk)
+            except Exception as e:
+                print(f"Skipping unusable JWK {jwk.get('kid')}: {str(e)}")
+        now = time.monotonic()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + (max_age if max_age is not None else self.default_max_age)
+
+    def _log_refresh_error(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.fetch_errors += 1
+            self._fetched_at = time.monotonic()
+            print(f"Error refreshing JWKS from {self.url}: {str(task.exception())}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "keys": len(self._keys),
+            "expires_in_seconds": max(0, round(self._expires_at - time.monotonic())),
+            "fetches": self.fetches,
+            "fetch_errors": self.fetch_errors,
+        }
+
+google_jwks_cache = JWKSCache(GOOGLE_JWKS_URL)
+
 async def verify_google_token(id_token: str) -> dict:
     """
-    Verify Google ID token (optional - for additional security)
-    This function can be used to verify the Google ID token on the server side
+    Verify a Google ID token's RS256 signature, expiry, issuer and audience
+    (one of GOOGLE_TOKEN_AUDIENCES). Returns the token claims.
     """
     try:
-        # For now, we'll just return a placeholder
-        # In production, you should verify the token with Google's servers
-        # You can use the google-auth library for this
-        return {"verified": True, "user_id": "placeholder"}
-    except Exception as e:
+        header = jwt.get_unverified_header(id_token)
+    except jwt.InvalidTokenError as e:
         raise HTTPException(status_code=401, detail=f"Google token verification failed: {str(e)}")
 
+    signing_key = await google_jwks_cache.get_key(header.get("kid"))
+    try:
+        claims = jwt.decode(
+            id_token,
+            signing_key.key,
+            algorithms=["RS256"],
+            audience=GOOGLE_TOKEN_AUDIENCES,
+            options={"require": ["exp", "iss", "aud"]}
+        )
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Google token verification failed: {str(e)}")
+
+    if claims.get("iss") not in GOOGLE_TOKEN_ISSUERS:
+        raise HTTPException(status_code=401, detail="Google token verification failed: invalid issuer")
+    return claims
+
+class SessionCache:
+    """
+    Bounded TTL cache of recently validated (user_id, session_id) pairs.
+    Lets get_current_user skip the user_sessions lookup; the least recently
+    used entries are evicted once max_entries is reached. A lookup that started
+    before an invalidation passes its epoch() to add() and is not cached, so it
+    cannot re-cache a session that was replaced while it was in flight.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, float]" = OrderedDict()
+        self._sessions_by_user: Dict[str, set] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def contains(self, user_id: str, session_id: str) -> bool:
+        key = (user_id, session_id)
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            self.misses += 1
+            return False
+        if expires_at <= time.monotonic():
+            self._discard(key)
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def epoch(self) -> int:
+        """Invalidation counter to pass to add() for a lookup started now"""
+        return self._epoch
+
+    def add(self, user_id: str, session_id: str, epoch: Optional[int] = None):
+        if epoch is not None and epoch != self._epoch:
+            return
+        key = (user_id, session_id)
+        self._entries[key] = time.monotonic() + self.ttl_seconds
+        self._entries.move_to_end(key)
+        self._sessions_by_user.setdefault(user_id, set()).add(session_id)
+        while len(self._entries) > self.max_entries:
+            oldest_key, _ = self._entries.popitem(last=False)
+            self._forget(oldest_key)
+
+    def invalidate(self, user_id: str, session_id: Optional[str] = None):
+        """Drop one session, or every cached session of the user when session_id is None"""
+        self._epoch += 1
+        if session_id is not None:
+            self._discard((user_id, session_id))
+            return
+        for sid in self._sessions_by_user.pop(user_id, set()):
+            self._entries.pop((user_id, sid), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _discard(self, key: tuple):
+        if self._entries.pop(key, None) is not None:
+            self._forget(key)
+
+    def _forget(self, key: tuple):
+        user_id, session_id = key
+        sessions = self._sessions_by_user.get(user_id)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._sessions_by_user[user_id]
+
+session_cache = SessionCache(SESSION_CACHE_TTL_SECONDS, SESSION_CACHE_MAX_ENTRIES)
+
+class SessionActivityBuffer:
+    """
+    Write-behind buffer for user_sessions.last_activity. Keeps only the latest
+    timestamp per session and flushes them as one unordered bulk_write.
+    """
+
+    def __init__(self, flush_interval_seconds: int):
+        self.flush_interval_seconds = flush_interval_seconds
+        self._pending: Dict[tuple, datetime] = {}
+        self.touches = 0
+        self.flushes = 0
+        self.writes = 0
+        self.last_flush_at: Optional[datetime] = None
+
+    def touch(self, user_id: str, session_id: str):
+        self._pending[(user_id, session_id)] = datetime.utcnow()
+        self.touches += 1
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        operations = [
+            # $max keeps the newest timestamp if flushes from several workers interleave
+            UpdateOne(
+                {"user_id": ObjectId(user_id), "session_id": session_id},
+                {"$max": {"last_activity": last_activity}}
+            )
+            for (user_id, session_id), last_activity in pending.items()
+        ]
+        try:
+            await db.user_sessions.bulk_write(operations, ordered=False)
+        except Exception:
+            # Put the timestamps back unless a newer touch already replaced them
+            for key, last_activity in pending.items():
+                self._pending.setdefault(key, last_activity)
+            raise
+        self.flushes += 1
+        self.writes += len(operations)
+        self.last_flush_at = datetime.utcnow()
+        return len(operations)
+
+    async def run(self):
+        """Background loop flushing buffered activity every flush_interval_seconds"""
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing session activity: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "flush_interval_seconds": self.flush_interval_seconds,
+            "touches": self.touches,
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+        }
+
+session_activity_buffer = SessionActivityBuffer(SESSION_ACTIVITY_FLUSH_SECONDS)
+
+class CounterAggregator:
+    """
+    Write-behind aggregator for counter fields such as materials.download_count.
+    Increments are summed per (collection, _id, field) in memory and flushed as
+    one unordered bulk_write of $inc per collection, so a popular document gets
+    one write per interval instead of one per read.
+    """
+
+    def __init__(self, flush_interval_seconds: int, max_pending: int):
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self._pending: Dict[tuple, int] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._early_flush: Optional[asyncio.Task] = None
+        self.increments = 0
+        self.flushes = 0
+        self.writes = 0
+        self.last_flush_at: Optional[datetime] = None
+
+    def increment(self, collection_name: str, doc_id: Any, field: str, amount: int = 1):
+        key = (collection_name, ObjectId(doc_id), field)
+        self._pending[key] = self._pending.get(key, 0) + amount
+        self.increments += 1
+        if len(self._pending) >= self.max_pending and (self._early_flush is None or self._early_flush.done()):
+            self._early_flush = asyncio.create_task(self._flush_logged())
+
+    async def flush(self) -> int:
+        if self._flush_lock is None:
+            # Created on first use so it binds to the running event loop
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            # One $inc per document, covering every dirty field on it
+            updates: Dict[str, Dict[ObjectId, Dict[str, int]]] = {}
+            for (collection_name, doc_id, field), amount in pending.items():
+                if amount:
+                    updates.setdefault(collection_name, {}).setdefault(doc_id, {})[field] = amount
+            written = 0
+            try:
+                for collection_name, docs in updates.items():
+                    doc_ids = list(docs)
+                    operations = [UpdateOne({"_id": doc_id}, {"$inc": docs[doc_id]}) for doc_id in doc_ids]
+                    failed, bulk_error = set(), None
+                    try:
+                        await db[collection_name].bulk_write(operations, ordered=False)
+                    except BulkWriteError as e:
+                        # Unordered: every operation except the listed writeErrors was applied
+                        failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                        bulk_error = e
+                    for index, doc_id in enumerate(doc_ids):
+                        if index in failed:
+                            continue
+                        written += 1
+                        for field in docs[doc_id]:
+                            pending.pop((collection_name, doc_id, field), None)
+                    if failed:
+                        raise bulk_error
+                    if bulk_error is not None:
+                        print(f"Counter flush for {collection_name} applied with write concern errors: "
+                              f"{bulk_error.details.get('writeConcernErrors')}")
+            except Exception:
+                # Return unwritten deltas to the buffer, adding to any made since; when the
+                # outcome is unknown (not a BulkWriteError) that is every delta not yet confirmed
+                for key, amount in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + amount
+                raise
+            self.flushes += 1
+            self.writes += written
+            self.last_flush_at = datetime.utcnow()
+            return written
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing counters: {str(e)}")
+
+    async def run(self):
+        """Background loop flushing counter deltas every flush_interval_seconds"""
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await self._flush_logged()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "flush_interval_seconds": self.flush_interval_seconds,
+            "increments": self.increments,
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+        }
+
+counter_aggregator = CounterAggregator(COUNTER_FLUSH_SECONDS, COUNTER_MAX_PENDING)
+
+class ShardedCounters:
+    """
+    Counters split over `shards` documents per entity in counter_shards. Each
+    increment picks a random shard, so concurrent enrollments in one course
+    do not queue on a single document. Reads add the shard totals to the value
+    stored on the entity (its count from before sharding); totals for a whole
+    (collection, field) are loaded with one aggregation and cached.
+    """
+
+    def __init__(self, shards: int, cache_seconds: int):
+        self.shards = shards
+        self.cache_seconds = cache_seconds
+        self._totals: Dict[tuple, Dict[ObjectId, int]] = {}
+        self._expires_at: Dict[tuple, float] = {}
+        self._loading: Dict[tuple, asyncio.Task] = {}
+        self.increments = 0
+        self.loads = 0
+
+    async def increment(self, collection_name: str, entity_id: Any, field: str, amount: int = 1):
+        oid = ObjectId(entity_id)
+        shard = {"collection": collection_name, "field": field, "entity_id": oid,
+                 "shard": random.randrange(self.shards)}
+        try:
+            await db.counter_shards.update_one(shard, {"$inc": {"count": amount}}, upsert=True)
+        except DuplicateKeyError:
+            # Lost the race to create this shard; it exists now
+            await db.counter_shards.update_one(shard, {"$inc": {"count": amount}})
+        self.increments += 1
+        totals = self._totals.get((collection_name, field))
+        if totals is not None:
+            totals[oid] = totals.get(oid, 0) + amount
+
+    async def totals(self, collection_name: str, field: str) -> Dict[ObjectId, int]:
+        key = (collection_name, field)
+        if key in self._totals and self._expires_at[key] > time.monotonic():
+            return self._totals[key]
+        task = self._loading.get(key)
+        if task is None or task.done():
+            task = self._loading[key] = asyncio.ensure_future(self._load(collection_name, field))
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            if key not in self._totals:
+                raise
+            print(f"Error loading {collection_name}.{field} counter shards, serving cached totals: {str(e)}")
+            return self._totals[key]
+
+    async def transform(self, collection_name: str, field: str, projection: Optional[dict] = None):
+        """Function adding shard totals to `field` of documents read with `projection`, or None if not read"""
+        if not projection_includes(projection, field):
+            return None
+        totals = await self.totals(collection_name, field)
+
+        def add_shard_totals(doc: dict) -> dict:
+            doc[field] = (doc.get(field) or 0) + totals.get(doc["_id"], 0)
+            return doc
+
+        return add_shard_totals
+
+    async def discard(self, collection_name: str, entity_id: Any):
+        """Drop the shards of a deleted entity"""
+        oid = ObjectId(entity_id)
+        await db.counter_shards.delete_many({"collection": collection_name, "entity_id": oid})
+        for (name, _), totals in self._totals.items():
+            if name == collection_name:
+                totals.pop(oid, None)
+
+    async def _load(self, collection_name: str, field: str) -> Dict[ObjectId, int]:
+        pipeline = [
+            {"$match": {"collection": collection_name, "field": field}},
+            {"$group": {"_id": "$entity_id", "count": {"$sum": "$count"}}},
+        ]
+        docs = await db.counter_shards.aggregate(pipeline).to_list(length=None)
+        totals = {doc["_id"]: doc["count"] for doc in docs}
+        self._totals[(collection_name, field)] = totals
+        self._expires_at[(collection_name, field)] = time.monotonic() + self.cache_seconds
+        self.loads += 1
+        return totals
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shards": self.shards,
+            "cache_seconds": self.cache_seconds,
+            "increments": self.increments,
+            "loads": self.loads,
+            "cached": {f"{name}.{field}": len(totals) for (name, field), totals in self._totals.items()},
+        }
+
+sharded_counters = ShardedCounters(COUNTER_SHARDS, COUNTER_SHARD_CACHE_SECONDS)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token_data = verify_jwt_token(credentials.credentials)
     user_id = token_data.get("user_id")
     session_id = token_data.get("session_id")
-    
+
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid authentication")
-    
+
     # If token doesn't have session_id (old token), require re-login
     if not session_id:
         raise HTTPException(status_code=401, detail="Please login again - session required")
-    
-    # Validate session is still active
-    session = await db.user_sessions.find_one({
-        "user_id": ObjectId(user_id),
-        "session_id": session_id,
-        "is_active": True
-    })
-    
-    if not session:
-        raise HTTPException(status_code=401, detail="Session expired or invalid - logged in from another device")
-    
-    # Update last activity
-    await db.user_sessions.update_one(
-        {"user_id": ObjectId(user_id), "session_id": session_id},
-        {"$set": {"last_activity": datetime.utcnow()}}
-    )
-    
+
+    token_type = token_data.get("type")
+    if token_type == "refresh":
+        raise HTTPException(status_code=401, detail="Refresh token cannot be used for API access")
+
+    # Short-lived access tokens are trusted for their lifetime without a session lookup;
+    # legacy tokens are validated against user_sessions (cached in-process)
+    if token_type != "access" and not session_cache.contains(user_id, session_id):
+        epoch = session_cache.epoch()
+        session = await db.user_sessions.find_one({
+            "user_id": ObjectId(user_id),
+            "session_id": session_id,
+            "is_active": True
+        })
+
+        if not session:
+            raise HTTPException(status_code=401, detail="Session expired or invalid - logged in from another device")
+
+        session_cache.add(user_id, session_id, epoch)
+
+    # Record last activity; written to user_sessions by the activity buffer
+    session_activity_buffer.touch(user_id, session_id)
+
     return user_id
 
+# Fire-and-forget tasks are held here until they finish: the event loop only keeps
+# weak references, so an unreferenced task can be garbage-collected mid-flight
+background_tasks: set = set()
+# Long-running loops started at startup, cancelled on shutdown
+background_loops: List[asyncio.Task] = []
+
+def _background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+def spawn_background(coro, name: Optional[str] = None) -> asyncio.Task:
+    """Run `coro` in the background, keeping a reference and logging its failure"""
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
 # Session Management Functions
 async def create_user_session(user_id: str, device_info: dict = None) -> str:
-    """Create a new user session and invalidate previous sessions"""
-    import uuid
-    
+    """
+    Create a new user session, replacing the user's active session in a single
+    upsert. A unique index on user_id, partial on is_active, guarantees at most
+    one active session per user; the replaced session is archived to
+    user_session_history in the background.
+    """
     # Generate unique session ID
     session_id = str(uuid.uuid4())
-    
-    # Count existing active sessions before invalidation
-    existing_sessions = await db.user_sessions.count_documents({
-        "user_id": ObjectId(user_id),
-        "is_active": True
-    })
-    
-    print(f"🔐 User {user_id} login: Found {existing_sessions} existing active sessions")
-    
-    # Invalidate all previous sessions for this user
-    result = await db.user_sessions.update_many(
-        {"user_id": ObjectId(user_id)},
-        {"$set": {"is_active": False, "ended_at": datetime.utcnow()}}
-    )
-    
-    print(f"🔐 Invalidated {result.modified_count} previous sessions for user {user_id}")
-    
-    # Create new session
+    now = datetime.utcnow()
+
     session_data = {
-        "user_id": ObjectId(user_id),
         "session_id": session_id,
         "is_active": True,
         "device_info": device_info or {},
-        "created_at": datetime.utcnow(),
-        "last_activity": datetime.utcnow(),
+        "created_at": now,
+        "last_activity": now,
         "ended_at": None
     }
-    
-    await db.user_sessions.insert_one(session_data)
+
+    for attempt in range(2):
+        try:
+            previous_session = await db.user_sessions.find_one_and_update(
+                {"user_id": ObjectId(user_id), "is_active": True},
+                {"$set": session_data},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            break
+        except DuplicateKeyError:
+            # A concurrent login for the same user inserted the active session first
+            if attempt:
+                raise
+
+    # Only after the upsert: a lookup that ran before it could otherwise re-cache the old session
+    session_cache.invalidate(user_id)
+    if previous_session:
+        spawn_background(archive_user_session(previous_session, ended_at=now, replaced_by=session_id),
+                         name="archive_user_session")
+
+    session_cache.add(user_id, session_id)
     print(f"🔐 Created new session {session_id} for user {user_id}")
-    
+
     return session_id
 
+async def archive_user_session(session: dict, ended_at: datetime, replaced_by: Optional[str] = None):
+    """Copy a replaced session into user_session_history (runs off the login path)"""
+    history_entry = {
+        **{k: v for k, v in session.items() if k != "_id"},
+        "is_active": False,
+        "ended_at": ended_at,
+        "replaced_by": replaced_by
+    }
+    try:
+        await db.user_session_history.insert_one(history_entry)
+    except Exception as e:
+        print(f"Error archiving session {session.get('session_id')}: {str(e)}")
+
 async def invalidate_user_session(user_id: str, session_id: str):
     """Invalidate a specific user session"""
+    session_cache.invalidate(user_id, session_id)
     await db.user_sessions.update_one(
         {
             "user_id": ObjectId(user_id),
@@ -272,16 +1040,667 @@ async def invalidate_user_session(user_id: str, session_id: str):
         }
     )
 
-def serialize_object(obj):
-    if isinstance(obj, ObjectId):
-        return str(obj)
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    if isinstance(obj, dict):
-        return {key: serialize_object(value) for key, value in obj.items()}
-    if isinstance(obj, list):
-        return [serialize_object(item) for item in obj]
-    return obj
+class SessionSweeper:
+    """
+    Moves ended sessions (is_active: False) from user_sessions into
+    user_session_history in batches, keeping user_sessions close to one
+    document per user. History rows keep their _id, so a sweep interrupted
+    between the insert and the delete is safe to repeat.
+    """
+
+    def __init__(self, interval_seconds: int, batch_size: int):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.runs = 0
+        self.archived_total = 0
+        self.last_archived = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def sweep(self) -> int:
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        archived = 0
+        while True:
+            batch = await db.user_sessions.find({"is_active": False}).sort("ended_at", 1) \
+                .limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                break
+            history = [{**session, "ended_at": session.get("ended_at") or now} for session in batch]
+            try:
+                await db.user_session_history.insert_many(history, ordered=False)
+            except BulkWriteError as e:
+                # Rows already archived by an earlier, interrupted sweep
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            await db.user_sessions.delete_many({
+                "_id": {"$in": [session["_id"] for session in batch]},
+                "is_active": False
+            })
+            archived += len(batch)
+
+        self.runs += 1
+        self.archived_total += archived
+        self.last_archived = archived
+        self.last_run_at = now
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+        return archived
+
+    async def run(self):
+        """Background loop sweeping ended sessions every interval_seconds"""
+        while True:
+            try:
+                archived = await self.sweep()
+                self.last_error = None
+                if archived:
+                    print(f"🔐 Archived {archived} ended sessions")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error sweeping user sessions: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "batch_size": self.batch_size,
+            "runs": self.runs,
+            "archived_total": self.archived_total,
+            "last_archived": self.last_archived,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+        }
+
+session_sweeper = SessionSweeper(SESSION_SWEEP_INTERVAL_SECONDS, SESSION_SWEEP_BATCH_SIZE)
+
+# Read Projection Helpers
+# Fields that never leave the database through read routes
+SECRET_FIELDS = {
+    "users": ["password"],
+}
+
+# Heavy fields left out of list responses unless requested with ?fields=
+# (feedback only remains on documents not yet moved by migrate_feedback_to_reviews.py)
+LIST_EXCLUDED_FIELDS = {
+    "courses": ["feedback"],
+    "materials": ["feedback"],
+    "online_tests": ["feedback"],
+    "payment_links": ["raw", "raw_last"],
+    "payment_status": ["raw"],
+}
+
+def read_projection(collection_name: str, fields: Optional[str] = None, for_list: bool = False) -> Optional[dict]:
+    """
+    Mongo projection for a read route. `fields` is the comma-separated ?fields=
+    value; without it, secrets (and heavy fields on list routes) are excluded.
+    """
+    secret = SECRET_FIELDS.get(collection_name, [])
+    if fields:
+        requested = sorted({f.strip() for f in fields.split(",") if f.strip()})
+        if any(f.startswith("$") for f in requested):
+            raise HTTPException(status_code=400, detail="Invalid field name in fields")
+        projection = {}
+        for field in requested:
+            # Skip secrets and sub-paths of a field that is already included whole
+            if field.split(".")[0] in secret or any(field.startswith(f"{p}.") for p in projection):
+                continue
+            projection[field] = 1
+        return projection or {"_id": 1}
+    excluded = secret + (LIST_EXCLUDED_FIELDS.get(collection_name, []) if for_list else [])
+    return {field: 0 for field in excluded} or None
+
+def projection_includes(projection: Optional[dict], field: str) -> bool:
+    """Whether documents read with `projection` contain `field` (a dotted path is covered by its parents)"""
+    if not projection:
+        return True
+    parts = field.split(".")
+    paths = [".".join(parts[:i]) for i in range(1, len(parts) + 1)]
+    if any(value for key, value in projection.items() if key != "_id"):
+        return any(projection.get(path) for path in paths)
+    return not any(path in projection for path in paths)
+
+def projection_with(projection: Optional[dict], fields: List[str]) -> tuple:
+    """
+    `projection` widened so documents also contain `fields` (e.g. join keys),
+    and the fields that had to be added, to strip from the response afterwards.
+    """
+    if not projection:
+        return projection, []
+    if any(projection.values()):
+        added = [field for field in fields if not projection.get(field)]
+        return {**projection, **dict.fromkeys(added, 1)}, added
+    added = [field for field in fields if field in projection]
+    return {key: value for key, value in projection.items() if key not in added} or None, added
+
+# Pagination Helpers
+class PageParams:
+    """
+    Keyset pagination query parameters shared by list routes (?after=&limit=).
+    Use as `page: PageParams = Depends()`.
+    """
+
+    def __init__(self, after: Optional[str] = None, limit: Optional[int] = None):
+        if limit is not None and limit < 1:
+            raise HTTPException(status_code=400, detail="limit must be a positive integer")
+        self.after = after
+        self.limit = limit
+
+    @property
+    def paginated(self) -> bool:
+        return self.after is not None or self.limit is not None or not LIST_PAGINATION_COMPAT
+
+    @property
+    def page_size(self) -> int:
+        return min(self.limit or LIST_DEFAULT_PAGE_SIZE, LIST_MAX_PAGE_SIZE)
+
+def field_value(doc: dict, path: str) -> Any:
+    """Value at a dotted path such as rating_summary.average, None when missing"""
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+def encode_cursor(doc: dict, sort_field: str = "_id") -> str:
+    """Opaque cursor pointing just past `doc` in (sort_field, _id) order"""
+    position = [field_value(doc, sort_field), doc["_id"]] if sort_field != "_id" else [doc["_id"]]
+    return base64.urlsafe_b64encode(json_util.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort_field: str = "_id") -> tuple:
+    """Returns (sort_value, last_id) for a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if sort_field == "_id":
+            return None, ObjectId(position[0])
+        value, last_id = position
+        return value, ObjectId(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+def keyset_filter(sort_field: str, direction: int, value: Any, last_id: ObjectId) -> dict:
+    """Filter matching documents after (value, last_id) in (sort_field, _id) order"""
+    id_op = "$gt" if direction == 1 else "$lt"
+    if sort_field == "_id":
+        return {"_id": {id_op: last_id}}
+    if value is None:
+        # Missing values sort first ascending and last descending
+        same_value = {sort_field: None, "_id": {id_op: last_id}}
+        return {"$or": [same_value, {sort_field: {"$ne": None}}]} if direction == 1 else same_value
+    clauses = [
+        {sort_field: {"$gt" if direction == 1 else "$lt": value}},
+        {sort_field: value, "_id": {id_op: last_id}}
+    ]
+    if direction == -1:
+        clauses.append({sort_field: None})
+    return {"$or": clauses}
+
+def sort_projection(projection: Optional[dict], sort_field: str) -> Optional[dict]:
+    """
+    `projection` widened to read `sort_field`, which the next cursor is built from.
+    A projected parent (rating_summary) already covers it; adding the sub-path
+    too would be a path collision.
+    """
+    if sort_field == "_id" or projection_includes(projection, sort_field):
+        return projection
+    if any(value for key, value in projection.items() if key != "_id"):
+        return {**projection, sort_field: 1}
+    # Exclusion projection that drops the field or one of its parents
+    return {key: value for key, value in projection.items()
+            if not (sort_field == key or sort_field.startswith(f"{key}."))} or None
+
+def keyset_find(collection, query: dict, after: Optional[str], sort_field: str = "_id",
+                direction: int = 1, projection: Optional[dict] = None):
+    """Motor cursor over `query` in (sort_field, _id) order, starting after the `after` cursor"""
+    sort = [("_id", direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+    projection = sort_projection(projection, sort_field)
+    if after:
+        after_filter = keyset_filter(sort_field, direction, *decode_cursor(after, sort_field))
+        query = {"$and": [query, after_filter]} if query else after_filter
+    return collection.find(query, projection).sort(sort)
+
+async def fetch_page(collection, query: dict, page: PageParams, sort_field: str = "_id",
+                     direction: int = 1, projection: Optional[dict] = None) -> tuple:
+    """
+    Fetch one page of `collection` in (sort_field, _id) order.
+    Returns (documents, next_cursor); next_cursor is None on the last page and
+    every matching document is returned when the request is not paginated.
+    """
+    if not page.paginated:
+        return await keyset_find(collection, query, None, sort_field, direction, projection).to_list(length=None), None
+
+    page_size = page.page_size
+    cursor = keyset_find(collection, query, page.after, sort_field, direction, projection)
+    docs = await cursor.limit(page_size + 1).to_list(length=page_size + 1)
+    if len(docs) <= page_size:
+        return docs, None
+    docs = docs[:page_size]
+    return docs, encode_cursor(docs[-1], sort_field)
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    """List routes stream NDJSON for `Accept: application/x-ndjson` or ?stream=1"""
+    return stream or "application/x-ndjson" in request.headers.get("accept", "")
+
+async def _ndjson_lines(cursor, transform=None):
+    try:
+        async for doc in cursor:
+            if transform:
+                doc = transform(doc)
+            yield dumps_json(doc) + b"\n"
+    finally:
+        await cursor.close()
+
+def stream_documents(collection, query: dict, page: PageParams, sort_field: str = "_id", direction: int = 1,
+                     projection: Optional[dict] = None, transform=None) -> StreamingResponse:
+    """
+    Stream matching documents as NDJSON straight from the Motor cursor, one line
+    per document. Starts after page.after and stops at page.limit when given.
+    The next batch is only fetched once the client has consumed the previous
+    one, so memory stays flat however large the collection is.
+    """
+    cursor = keyset_find(collection, query, page.after, sort_field, direction, projection).batch_size(STREAM_BATCH_SIZE)
+    if page.limit:
+        cursor = cursor.limit(page.limit)
+    return StreamingResponse(_ndjson_lines(cursor, transform), media_type="application/x-ndjson")
+
+def page_response(key: str, docs: List[dict], next_cursor: Optional[str], page: PageParams) -> dict:
+    """List response in the legacy {key: [...]} shape, plus next_cursor when paginated"""
+    response = {key: docs}
+    if page.paginated:
+        response["next_cursor"] = next_cursor
+    return response
+
+# Request-scoped Loaders
+class DataLoader:
+    """
+    Coalesces load() calls made in the same event-loop tick into one
+    `_id: {$in: [...]}` query and memoizes the results, so a request that
+    resolves N references costs one round trip. Create one per request.
+    `counters` names the sharded counter fields (see ShardedCounters) whose
+    shard totals are added to the loaded documents.
+    """
+
+    def __init__(self, collection, projection: Optional[dict] = None, counters: tuple = ()):
+        self.collection = collection
+        self.projection = projection
+        self.counters = counters
+        self._futures: Dict[ObjectId, asyncio.Future] = {}
+        self._pending: List[ObjectId] = []
+        self.queries = 0
+
+    def load(self, key: Any) -> "asyncio.Future":
+        """Future resolving to the document with _id `key`, or None"""
+        loop = asyncio.get_running_loop()
+        try:
+            # ObjectId(None) would generate a fresh id, so a missing reference is not a key
+            oid = key if isinstance(key, ObjectId) else ObjectId(key) if key else None
+        except Exception:
+            oid = None
+        if oid is None:
+            future = loop.create_future()
+            future.set_result(None)
+            return future
+        future = self._futures.get(oid)
+        if future is None:
+            future = self._futures[oid] = loop.create_future()
+            self._pending.append(oid)
+            if len(self._pending) == 1:
+                # Runs after every task already scheduled for this tick has queued its keys
+                loop.call_soon(lambda: spawn_background(self._dispatch(), name="DataLoader._dispatch"))
+        return future
+
+    async def load_many(self, keys: List[Any]) -> List[Optional[dict]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    async def _dispatch(self):
+        keys, self._pending = self._pending, []
+        self.queries += 1
+        try:
+            docs = await self.collection.find({"_id": {"$in": keys}}, self.projection).to_list(length=len(keys))
+            for field in self.counters:
+                add_totals = await sharded_counters.transform(self.collection.name, field, self.projection)
+                if add_totals:
+                    docs = [add_totals(doc) for doc in docs]
+            found = {doc["_id"]: doc for doc in docs}
+        except BaseException as e:
+            # Fail every waiter instead of leaving it hanging; a later load() retries the key
+            for key in keys:
+                future = self._futures.pop(key)
+                if future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            raise
+        for key in keys:
+            future = self._futures[key]
+            if not future.done():
+                future.set_result(found.get(key))
+
+class RequestLoaders:
+    """Per-request loaders, injected with `loaders: RequestLoaders = Depends()`"""
+
+    def __init__(self):
+        self.users = DataLoader(db.users, read_projection("users"))
+        self.courses = DataLoader(db.courses, read_projection("courses", for_list=True), counters=("enrolled_students",))
+
+# ?expand= names: the reference field each one resolves and the loader used
+EXPANSIONS = {
+    "user": ("user_id", "users"),
+    "course": ("course_id", "courses"),
+}
+
+def parse_expand(expand: Optional[str], allowed: tuple, stream: bool = False) -> List[str]:
+    """Validated ?expand= names, e.g. `user,course`"""
+    names = [name.strip() for name in (expand or "").split(",") if name.strip()]
+    invalid = [name for name in names if name not in allowed]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"expand must be one of: {', '.join(allowed)}")
+    if names and stream:
+        raise HTTPException(status_code=400, detail="expand is not supported on streamed responses")
+    return names
+
+async def expand_documents(docs: List[dict], expand: List[str], loaders: RequestLoaders):
+    """Attach each expanded reference (e.g. doc["user"] for doc["user_id"]), batched per loader"""
+    if not expand or not docs:
+        return
+    targets = []
+    for name in expand:
+        field, loader_name = EXPANSIONS[name]
+        loader = getattr(loaders, loader_name)
+        targets.extend((doc, name, loader.load(doc.get(field))) for doc in docs)
+    results = await asyncio.gather(*(future for _, _, future in targets))
+    for (doc, name, _), related in zip(targets, results):
+        doc[name] = related
+
+# Catalog listing order and rating filter (?sort=rating&min_rating=4)
+CATALOG_SORTS = {"rating": ("rating_summary.average", -1)}
+
+def catalog_order(sort: Optional[str]) -> tuple:
+    """(sort_field, direction) for a catalog list route's ?sort= value"""
+    if not sort:
+        return "_id", 1
+    if sort not in CATALOG_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(CATALOG_SORTS)}")
+    return CATALOG_SORTS[sort]
+
+def rating_filter(min_rating: Optional[float]) -> dict:
+    return {"rating_summary.average": {"$gte": min_rating}} if min_rating is not None else {}
+
+# Response Compression
+RESPONSE_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the supported encoding with the highest q-value, preferring brotli on ties"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in RESPONSE_ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def _compress_body(body: bytes, encoding: str) -> tuple:
+    """Compressed body and the CPU seconds it took (thread_time, so it is right on worker threads too)"""
+    started = time.thread_time()
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    return compressed, time.thread_time() - started
+
+class CompressionStats:
+    """
+    Compresses response bodies and keeps CPU time and byte counts per encoding,
+    for tuning the compression level. Bodies of RESPONSE_COMPRESSION_THREAD_MIN_BYTES
+    or more are compressed on a worker thread so they do not stall the event loop.
+    """
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self.precompressed_hits = 0
+        self.offloaded = 0
+
+    async def compress(self, body: bytes, encoding: str) -> bytes:
+        if len(body) >= RESPONSE_COMPRESSION_THREAD_MIN_BYTES:
+            compressed, cpu_seconds = await asyncio.to_thread(_compress_body, body, encoding)
+            self.offloaded += 1
+        else:
+            compressed, cpu_seconds = _compress_body(body, encoding)
+        totals = self._totals.setdefault(encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0})
+        totals["responses"] += 1
+        totals["bytes_in"] += len(body)
+        totals["bytes_out"] += len(compressed)
+        totals["cpu_seconds"] += cpu_seconds
+        return compressed
+
+    def stats(self) -> Dict[str, Any]:
+        encodings = {}
+        for encoding, totals in self._totals.items():
+            megabytes_in = totals["bytes_in"] / (1024 * 1024)
+            encodings[encoding] = {
+                **totals,
+                "ratio": round(totals["bytes_out"] / totals["bytes_in"], 4) if totals["bytes_in"] else None,
+                "cpu_ms_per_mb": round(totals["cpu_seconds"] * 1000 / megabytes_in, 2) if megabytes_in else None,
+            }
+        return {
+            "enabled": RESPONSE_COMPRESSION_ENABLED,
+            "available": list(RESPONSE_ENCODINGS),
+            "min_bytes": RESPONSE_COMPRESSION_MIN_BYTES,
+            "thread_min_bytes": RESPONSE_COMPRESSION_THREAD_MIN_BYTES,
+            "offloaded": self.offloaded,
+            "gzip_level": RESPONSE_GZIP_LEVEL,
+            "brotli_quality": RESPONSE_BROTLI_QUALITY if brotli is not None else None,
+            "precompressed_hits": self.precompressed_hits,
+            "encodings": encodings,
+        }
+
+compression_stats = CompressionStats()
+
+def response_encoding(request: Request, body: bytes) -> Optional[str]:
+    if not RESPONSE_COMPRESSION_ENABLED or len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return None
+    return negotiate_encoding(request.headers.get("accept-encoding"))
+
+async def compress_response(request: Request, response: Response) -> Response:
+    """Compress a rendered JSON response in place when the client accepts it"""
+    if not isinstance(response, MongoJSONResponse) or "content-encoding" in response.headers:
+        return response
+    response.headers["Vary"] = "Accept-Encoding"
+    encoding = response_encoding(request, response.body)
+    if encoding is None:
+        return response
+    response.body = await compression_stats.compress(response.body, encoding)
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = str(len(response.body))
+    return response
+
+# Response Cache
+# Public catalog routes and the collections their responses are built from
+CACHED_ROUTE_COLLECTIONS: Dict[str, tuple] = {
+    "/courses": ("courses",),
+    "/courses/{course_id}": ("courses",),
+    "/tests": ("online_tests",),
+    "/tests/{test_id}": ("online_tests",),
+    "/materials": ("materials",),
+    "/current-affairs": ("current_affairs",),
+    "/carousel": ("carousel",),
+    "/youtube": ("youtube_videos",),
+    "/text-slider": ("text_slider",),
+    "/contact": ("contacts",),
+    "/terms-conditions": ("terms_conditions",),
+    "/institutions": ("institutions",),
+}
+
+# Routes answering If-None-Match without caching, because every read counts a view
+CONDITIONAL_GET_ROUTES = {"/materials/{material_id}", "/current-affairs/{affairs_id}"}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+class CachedResponse:
+    """
+    Rendered body of a GET response and its strong ETag, a hash of the body
+    computed once when the response is first rendered. Cached entries also
+    keep a compressed variant per encoding.
+    """
+
+    __slots__ = ("body", "collections", "etag", "variants", "expires_at")
+
+    def __init__(self, body: bytes, collections: tuple):
+        self.body = body
+        self.collections = collections
+        self.etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.variants: Dict[str, bytes] = {}
+        self.expires_at = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(variant) for variant in self.variants.values())
+
+    async def precompress(self):
+        if RESPONSE_COMPRESSION_ENABLED and len(self.body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+            for encoding in RESPONSE_ENCODINGS:
+                self.variants[encoding] = await compression_stats.compress(self.body, encoding)
+
+    async def to_response(self, request: Request) -> Response:
+        encoding = response_encoding(request, self.body)
+        # Each encoding is a distinct representation, so it gets its own strong ETag
+        etag = self.etag if encoding is None else '%s-%s"' % (self.etag[:-1], encoding)
+        # no-cache lets clients store the body but revalidate it on every use
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(content=self.body, media_type="application/json", headers=headers)
+        body = self.variants.get(encoding)
+        if body is None:
+            body = await compression_stats.compress(self.body, encoding)
+        else:
+            compression_stats.precompressed_hits += 1
+        headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+class ResponseCache:
+    """
+    LRU cache of rendered catalog responses keyed by route, query string and
+    the version of every collection the route reads. mark_changed bumps a
+    collection's version and drops the entries built from it.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int, max_bytes: int, max_entry_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, request: Request, collections: tuple) -> tuple:
+        query = tuple(sorted(request.query_params.multi_items()))
+        versions = tuple(self._versions.get(name, 0) for name in collections)
+        return (request.url.path, query, versions)
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def fits(self, entry: CachedResponse) -> bool:
+        """Whether put() would keep `entry`; checked before precompressing, which only adds to its size"""
+        return entry.size <= self.max_entry_bytes
+
+    def put(self, key: tuple, entry: CachedResponse):
+        if not self.fits(entry):
+            return
+        self._discard(key)
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        self._entries[key] = entry
+        self.size_bytes += entry.size
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._discard(oldest_key)
+            self.evictions += 1
+
+    def mark_changed(self, collection_name: str):
+        self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+        self.invalidations += 1
+        stale = [key for key, entry in self._entries.items() if collection_name in entry.collections]
+        for key in stale:
+            self._discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "versions": dict(self._versions),
+        }
+
+    def _discard(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry.size
+
+response_cache = ResponseCache(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES,
+                               RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES)
+
+# Called with (collection_name, doc_ids) after each write, e.g. by the catalog search index
+collection_change_listeners: List[Any] = []
+
+def mark_collection_changed(collection_name: str, *doc_ids: Any):
+    """
+    Call after every create, update or delete so cached catalog responses are
+    rebuilt. Pass the written _ids when known; none means the whole collection.
+    """
+    response_cache.mark_changed(collection_name)
+    for listener in collection_change_listeners:
+        listener(collection_name, doc_ids)
 
 # Background task for payment status polling
 async def poll_payment_status():
@@ -365,6 +1784,9 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
 class GoogleAuth(BaseModel):
     firebase_uid: str
     name: str
@@ -504,14 +1926,14 @@ async def save_file(file: UploadFile, folder: str) -> str:
 @app.post("/auth/register")
 async def register_user(user_data: UserRegistration):
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 1})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
     user_dict = {
         **user_data.dict(),
-        "password": hash_password(user_data.password),
+        "password": await password_hasher.hash(user_data.password),
         "dob": datetime.fromisoformat(user_data.dob.replace('Z', '+00:00')),
         "is_active": True,
         "last_login": datetime.utcnow(),
@@ -523,116 +1945,116 @@ async def register_user(user_data: UserRegistration):
     
     # Create new session for this user
     session_id = await create_user_session(str(result.inserted_id))
-    token = create_jwt_token(str(result.inserted_id), session_id)
+    tokens = issue_auth_tokens(str(result.inserted_id), session_id)
     
     return {
         "message": "User registered successfully",
         "user_id": str(result.inserted_id),
-        "token": token
+        **tokens
     }
 
 @app.post("/auth/login")
 async def login_user(login_data: UserLogin):
     user = await db.users.find_one({"email": login_data.email})
-    if not user or user["password"] != hash_password(login_data.password):
+    if not user or not await password_hasher.verify(login_data.password, user.get("password")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    # Update last login
+
+    # Update last login, upgrading legacy sha256 / weaker hashes in the same write
+    update_fields = {"last_login": datetime.utcnow()}
+    if password_needs_rehash(user["password"]):
+        update_fields["password"] = await password_hasher.hash(login_data.password)
     await db.users.update_one(
         {"_id": user["_id"]},
-        {"$set": {"last_login": datetime.utcnow()}}
+        {"$set": update_fields}
     )
     
     # Create new session (this will invalidate previous sessions)
     session_id = await create_user_session(str(user["_id"]))
-    token = create_jwt_token(str(user["_id"]), session_id)
-    
+    tokens = issue_auth_tokens(str(user["_id"]), session_id)
+
+    for field in SECRET_FIELDS["users"]:
+        user.pop(field, None)
     return {
         "message": "Login successful",
         "user_id": str(user["_id"]),
-        "token": token,
-        "user": serialize_object(user)
+        **tokens,
+        "user": user
     }
 
 @app.post("/auth/google")
 async def google_auth(google_data: GoogleAuth):
+    if GOOGLE_TOKEN_VERIFICATION_ENABLED:
+        if not google_data.id_token:
+            raise HTTPException(status_code=401, detail="Google ID token is required")
+        claims = await verify_google_token(google_data.id_token)
+        if (claims.get("email") or "").lower() != google_data.email.lower():
+            raise HTTPException(status_code=401, detail="Google ID token does not match the supplied email")
+
     try:
-        # Check if user exists by email or firebase_uid
-        existing_user = await db.users.find_one({
-            "$or": [
-                {"email": google_data.email},
-                {"firebase_uid": google_data.firebase_uid}
-            ]
-        })
-        
-        if existing_user:
-            # User exists, update their information and login
-            update_data = {
-                "firebase_uid": google_data.firebase_uid,
-                "name": google_data.name,
-                "photo_url": google_data.photo_url,
-                "provider": google_data.provider,
-                "last_login": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            # Only update fields that are not empty
-            update_data = {k: v for k, v in update_data.items() if v is not None}
-            
-            await db.users.update_one(
-                {"_id": existing_user["_id"]},
-                {"$set": update_data}
-            )
-            
-            # Get updated user data
-            updated_user = await db.users.find_one({"_id": existing_user["_id"]})
-            
-            # Create new session (this will invalidate previous sessions)
-            session_id = await create_user_session(str(existing_user["_id"]))
-            token = create_jwt_token(str(existing_user["_id"]), session_id)
-            
-            return {
-                "message": "Google authentication successful",
-                "user_id": str(existing_user["_id"]),
-                "token": token,
-                "user": serialize_object(updated_user)
-            }
+        now = datetime.utcnow()
+        set_fields = {
+            "firebase_uid": google_data.firebase_uid,
+            "name": google_data.name,
+            "provider": google_data.provider,
+            "last_login": now,
+            "updated_at": now
+        }
+        # Defaults for new accounts; the profile can be completed later
+        set_on_insert = {
+            "_id": ObjectId(),
+            "email": google_data.email,
+            "contact_no": "",
+            "gender": "other",
+            "dob": None,
+            "education": "Higher education",
+            "course": "Select Course",
+            "password": None,  # No password for Google users
+            "is_active": True,
+            "created_at": now
+        }
+        # Only overwrite the stored photo when Google sent one
+        if google_data.photo_url is not None:
+            set_fields["photo_url"] = google_data.photo_url
         else:
-            # New user, create account with Google data
-            user_dict = {
-                "firebase_uid": google_data.firebase_uid,
-                "name": google_data.name,
-                "email": google_data.email,
-                "photo_url": google_data.photo_url,
-                "provider": google_data.provider,
-                "contact_no": "",  # Empty for Google users, can be filled later
-                "gender": "other",  # Default value, can be updated later
-                "dob": None,  # Can be updated later
-                "education": "Higher education",  # Default value
-                "course": "Select Course",  # Default value
-                "password": None,  # No password for Google users
-                "is_active": True,
-                "last_login": datetime.utcnow(),
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            result = await db.users.insert_one(user_dict)
-            
-            # Create new session for this user
-            session_id = await create_user_session(str(result.inserted_id))
-            token = create_jwt_token(str(result.inserted_id), session_id)
-            
-            # Get the created user data
-            new_user = await db.users.find_one({"_id": result.inserted_id})
-            
-            return {
-                "message": "Google authentication successful - New user created",
-                "user_id": str(result.inserted_id),
-                "token": token,
-                "user": serialize_object(new_user)
-            }
-            
+            set_on_insert["photo_url"] = None
+
+        # Find-or-create the user by email or firebase_uid in a single round trip. The
+        # document from before the update is returned: None means this call inserted it.
+        user_filter = {"$or": [{"email": google_data.email}, {"firebase_uid": google_data.firebase_uid}]}
+        user_update = {"$set": set_fields, "$setOnInsert": set_on_insert}
+        for attempt in range(2):
+            try:
+                previous = await db.users.find_one_and_update(
+                    user_filter, user_update,
+                    projection=read_projection("users"),
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+                break
+            except DuplicateKeyError:
+                # A concurrent first login created the account; the retry updates that one
+                if attempt:
+                    raise HTTPException(status_code=409, detail="Account is being created by another login, please retry")
+        is_new_user = previous is None
+        if is_new_user:
+            user = {k: v for k, v in set_on_insert.items() if k not in SECRET_FIELDS["users"]}
+        else:
+            user = previous
+        user.update(set_fields)
+
+        # Create new session (this will invalidate previous sessions)
+        session_id = await create_user_session(str(user["_id"]))
+        tokens = issue_auth_tokens(str(user["_id"]), session_id)
+
+        return {
+            "message": "Google authentication successful - New user created" if is_new_user else "Google authentication successful",
+            "user_id": str(user["_id"]),
+            **tokens,
+            "user": user
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Google authentication failed: {str(e)}")
 
@@ -641,14 +2063,14 @@ async def check_session_validity(current_user_id: str = Depends(get_current_user
     """Check if current session is valid - used for app startup validation"""
     try:
         # If we reach here, the session is valid (get_current_user validates it)
-        user = await db.users.find_one({"_id": ObjectId(current_user_id)})
+        user = await db.users.find_one({"_id": ObjectId(current_user_id)}, read_projection("users"))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
             
         return {
             "valid": True,
             "message": "Session is active",
-            "user": serialize_object(user)
+            "user": user
         }
     except HTTPException as e:
         # Re-raise HTTP exceptions (like 401 from get_current_user)
@@ -656,6 +2078,37 @@ async def check_session_validity(current_user_id: str = Depends(get_current_user
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Session check failed: {str(e)}")
 
+@app.post("/auth/refresh")
+async def refresh_auth_tokens(refresh_data: TokenRefresh):
+    """
+    Exchange a refresh token for a new access/refresh token pair.
+    This is the only point where dual-token clients hit user_sessions, so a
+    login on another device takes effect within one access-token lifetime.
+    """
+    if not DUAL_TOKEN_MODE_ENABLED:
+        raise HTTPException(status_code=400, detail="Token refresh is not enabled")
+
+    token_data = verify_jwt_token(refresh_data.refresh_token)
+    user_id = token_data.get("user_id")
+    session_id = token_data.get("session_id")
+    if token_data.get("type") != "refresh" or not user_id or not session_id:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    session = await db.user_sessions.find_one(
+        {"user_id": ObjectId(user_id), "session_id": session_id, "is_active": True},
+        {"_id": 1}
+    )
+    if not session:
+        raise HTTPException(status_code=401, detail="Session expired or invalid - logged in from another device")
+
+    session_activity_buffer.touch(user_id, session_id)
+
+    return {
+        "message": "Token refreshed",
+        "user_id": user_id,
+        **issue_auth_tokens(user_id, session_id)
+    }
+
 @app.post("/auth/logout")
 async def logout_user(current_user_id: str = Depends(get_current_user)):
     """Logout user and invalidate current session"""
@@ -663,6 +2116,7 @@ async def logout_user(current_user_id: str = Depends(get_current_user)):
         # Get current session info from token
         # Note: We need to extract session_id from the current request
         # For now, we'll invalidate all sessions for this user
+        session_cache.invalidate(current_user_id)
         await db.user_sessions.update_many(
             {"user_id": ObjectId(current_user_id)},
             {"$set": {"is_active": False, "ended_at": datetime.utcnow()}}
@@ -685,7 +2139,7 @@ async def link_google_account(link_data: dict, current_user_id: str = Depends(ge
             raise HTTPException(status_code=400, detail="Firebase UID is required")
         
         # Check if this Firebase UID is already linked to another account
-        existing_google_user = await db.users.find_one({"firebase_uid": firebase_uid})
+        existing_google_user = await db.users.find_one({"firebase_uid": firebase_uid}, {"_id": 1})
         if existing_google_user and str(existing_google_user["_id"]) != current_user_id:
             raise HTTPException(status_code=400, detail="This Google account is already linked to another user")
         
@@ -709,11 +2163,11 @@ async def link_google_account(link_data: dict, current_user_id: str = Depends(ge
             raise HTTPException(status_code=404, detail="User not found")
         
         # Get updated user data
-        updated_user = await db.users.find_one({"_id": ObjectId(current_user_id)})
+        updated_user = await db.users.find_one({"_id": ObjectId(current_user_id)}, read_projection("users"))
         
         return {
             "message": "Google account linked successfully",
-            "user": serialize_object(updated_user)
+            "user": updated_user
         }
         
     except HTTPException:
@@ -728,7 +2182,7 @@ async def unlink_google_account(current_user_id: str = Depends(get_current_user)
     """
     try:
         # Get current user
-        user = await db.users.find_one({"_id": ObjectId(current_user_id)})
+        user = await db.users.find_one({"_id": ObjectId(current_user_id)}, {"password": 1})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -753,11 +2207,11 @@ async def unlink_google_account(current_user_id: str = Depends(get_current_user)
             raise HTTPException(status_code=404, detail="User not found")
         
         # Get updated user data
-        updated_user = await db.users.find_one({"_id": ObjectId(current_user_id)})
+        updated_user = await db.users.find_one({"_id": ObjectId(current_user_id)}, read_projection("users"))
         
         return {
             "message": "Google account unlinked successfully",
-            "user": serialize_object(updated_user)
+            "user": updated_user
         }
         
     except HTTPException:
@@ -768,26 +2222,28 @@ async def unlink_google_account(current_user_id: str = Depends(get_current_user)
 # =============== USER ROUTES ===============
 
 @app.get("/users")
-async def get_all_users():
-    users = []
-    async for user in db.users.find():
-        users.append(serialize_object(user))
-    return {"users": users}
+async def get_all_users(page: PageParams = Depends(), fields: Optional[str] = None,
+                        stream: bool = Depends(wants_ndjson)):
+    projection = read_projection("users", fields, for_list=True)
+    if stream:
+        return stream_documents(db.users, {}, page, projection=projection)
+    users, next_cursor = await fetch_page(db.users, {}, page, projection=projection)
+    return page_response("users", users, next_cursor, page)
 
 @app.get("/users/{user_id}")
-async def get_user(user_id: str):
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+async def get_user(user_id: str, fields: Optional[str] = None):
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, read_projection("users", fields))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"user": serialize_object(user)}
+    return {"user": user}
 
 @app.get("/users/email/{email}")
-async def get_user_by_email(email: str):
+async def get_user_by_email(email: str, fields: Optional[str] = None):
     """Check if user exists by email (useful for Google auth)"""
-    user = await db.users.find_one({"email": email})
+    user = await db.users.find_one({"email": email}, read_projection("users", fields))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"user": serialize_object(user)}
+    return {"user": user}
 
 @app.put("/users/{user_id}")
 async def update_user(user_id: str, user_data: dict):
@@ -821,10 +2277,10 @@ async def update_user_profile(user_id: str, profile_data: dict, current_user_id:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Return updated user data
-    updated_user = await db.users.find_one({"_id": ObjectId(user_id)})
+    updated_user = await db.users.find_one({"_id": ObjectId(user_id)}, read_projection("users"))
     return {
         "message": "Profile updated successfully",
-        "user": serialize_object(updated_user)
+        "user": updated_user
     }
 
 @app.delete("/users/{user_id}")
@@ -844,21 +2300,20 @@ async def create_institution(institution: InstitutionCreate):
         "updated_at": datetime.utcnow()
     }
     result = await db.institutions.insert_one(institution_dict)
+    mark_collection_changed("institutions")
     return {"message": "Institution created", "id": str(result.inserted_id)}
 
 @app.get("/institutions")
-async def get_institutions():
-    institutions = []
-    async for inst in db.institutions.find():
-        institutions.append(serialize_object(inst))
-    return {"institutions": institutions}
+async def get_institutions(page: PageParams = Depends()):
+    institutions, next_cursor = await fetch_page(db.institutions, {}, page)
+    return page_response("institutions", institutions, next_cursor, page)
 
 @app.get("/institutions/{institution_id}")
 async def get_institution(institution_id: str):
     institution = await db.institutions.find_one({"_id": ObjectId(institution_id)})
     if not institution:
         raise HTTPException(status_code=404, detail="Institution not found")
-    return {"institution": serialize_object(institution)}
+    return {"institution": institution}
 
 @app.put("/institutions/{institution_id}")
 async def update_institution(institution_id: str, institution_data: dict):
@@ -869,6 +2324,7 @@ async def update_institution(institution_id: str, institution_data: dict):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Institution not found")
+    mark_collection_changed("institutions")
     return {"message": "Institution updated successfully"}
 
 @app.delete("/institutions/{institution_id}")
@@ -876,6 +2332,7 @@ async def delete_institution(institution_id: str):
     result = await db.institutions.delete_one({"_id": ObjectId(institution_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Institution not found")
+    mark_collection_changed("institutions")
     return {"message": "Institution deleted successfully"}
 
 # =============== TESTIMONIAL ROUTES ===============
@@ -915,18 +2372,16 @@ async def create_testimonial(
     return {"message": "Testimonial created", "id": str(result.inserted_id)}
 
 @app.get("/testimonials")
-async def get_testimonials():
-    testimonials = []
-    async for test in db.testimonials.find():
-        testimonials.append(serialize_object(test))
-    return {"testimonials": testimonials}
+async def get_testimonials(page: PageParams = Depends()):
+    testimonials, next_cursor = await fetch_page(db.testimonials, {}, page)
+    return page_response("testimonials", testimonials, next_cursor, page)
 
 @app.get("/testimonials/{testimonial_id}")
 async def get_testimonial(testimonial_id: str):
     testimonial = await db.testimonials.find_one({"_id": ObjectId(testimonial_id)})
     if not testimonial:
         raise HTTPException(status_code=404, detail="Testimonial not found")
-    return {"testimonial": serialize_object(testimonial)}
+    return {"testimonial": testimonial}
 
 @app.put("/testimonials/{testimonial_id}")
 async def update_testimonial(testimonial_id: str, testimonial_data: dict):
@@ -984,21 +2439,36 @@ async def create_course(
     }
     
     result = await db.courses.insert_one(course_dict)
+    mark_collection_changed("courses", result.inserted_id)
     return {"message": "Course created", "id": str(result.inserted_id)}
 
 @app.get("/courses")
-async def get_courses():
-    courses = []
-    async for course in db.courses.find():
-        courses.append(serialize_object(course))
-    return {"courses": courses}
+async def get_courses(page: PageParams = Depends(), fields: Optional[str] = None,
+                      sort: Optional[str] = None, min_rating: Optional[float] = None,
+                      stream: bool = Depends(wants_ndjson)):
+    projection = read_projection("courses", fields, for_list=True)
+    sort_field, direction = catalog_order(sort)
+    query = rating_filter(min_rating)
+    enrolled = await sharded_counters.transform("courses", "enrolled_students", projection)
+    if stream:
+        return stream_documents(db.courses, query, page, sort_field, direction, projection=projection, transform=enrolled)
+    courses, next_cursor = await fetch_page(db.courses, query, page, sort_field, direction, projection=projection)
+    if enrolled:
+        courses = [enrolled(course) for course in courses]
+    return page_response("courses", courses, next_cursor, page)
 
 @app.get("/courses/{course_id}")
-async def get_course(course_id: str):
-    course = await db.courses.find_one({"_id": ObjectId(course_id)})
+async def get_course(course_id: str, fields: Optional[str] = None):
+    projection = read_projection("courses", fields)
+    course = await db.courses.find_one({"_id": ObjectId(course_id)}, projection)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-    return {"course": serialize_object(course)}
+    enrolled = await sharded_counters.transform("courses", "enrolled_students", projection)
+    if enrolled:
+        enrolled(course)
+    if projection_includes(projection, "feedback"):
+        course["feedback"] = await recent_reviews("course", course["_id"])
+    return {"course": course}
 
 @app.put("/courses/{course_id}")
 async def update_course(
@@ -1050,6 +2520,7 @@ async def update_course(
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Course not found")
+    mark_collection_changed("courses", course_id)
     return {"message": "Course updated successfully"}
 
 @app.delete("/courses/{course_id}")
@@ -1057,6 +2528,8 @@ async def delete_course(course_id: str):
     result = await db.courses.delete_one({"_id": ObjectId(course_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Course not found")
+    await sharded_counters.discard("courses", course_id)
+    mark_collection_changed("courses", course_id)
     return {"message": "Course deleted successfully"}
 
 # =============== MATERIAL ROUTES ===============
@@ -1099,35 +2572,40 @@ async def create_material(
         "sample_images": sample_image_urls,
         "download_count": 0,
         "tags": [],
-        "feedback": [],
         "is_active": True,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
     result = await db.materials.insert_one(material_dict)
+    mark_collection_changed("materials", result.inserted_id)
     return {"message": "Material created", "id": str(result.inserted_id)}
 
 @app.get("/materials")
-async def get_materials():
-    materials = []
-    async for material in db.materials.find():
-        materials.append(serialize_object(material))
-    return {"materials": materials}
+async def get_materials(page: PageParams = Depends(), fields: Optional[str] = None,
+                        sort: Optional[str] = None, min_rating: Optional[float] = None,
+                        stream: bool = Depends(wants_ndjson)):
+    projection = read_projection("materials", fields, for_list=True)
+    sort_field, direction = catalog_order(sort)
+    query = rating_filter(min_rating)
+    if stream:
+        return stream_documents(db.materials, query, page, sort_field, direction, projection=projection)
+    materials, next_cursor = await fetch_page(db.materials, query, page, sort_field, direction, projection=projection)
+    return page_response("materials", materials, next_cursor, page)
 
 @app.get("/materials/{material_id}")
-async def get_material(material_id: str):
-    material = await db.materials.find_one({"_id": ObjectId(material_id)})
+async def get_material(material_id: str, fields: Optional[str] = None):
+    projection = read_projection("materials", fields)
+    material = await db.materials.find_one({"_id": ObjectId(material_id)}, projection)
     if not material:
         raise HTTPException(status_code=404, detail="Material not found")
+    if projection_includes(projection, "feedback"):
+        material["feedback"] = await recent_reviews("material", material["_id"])
     
     # Increment view/access count
-    await db.materials.update_one(
-        {"_id": ObjectId(material_id)},
-        {"$inc": {"download_count": 1}}
-    )
+    counter_aggregator.increment("materials", material["_id"], "download_count")
     
-    return {"material": serialize_object(material)}
+    return {"material": material}
 
 @app.put("/materials/{material_id}")
 async def update_material(material_id: str, material_data: dict):
@@ -1138,6 +2616,7 @@ async def update_material(material_id: str, material_data: dict):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Material not found")
+    mark_collection_changed("materials", material_id)
     return {"message": "Material updated successfully"}
 
 @app.delete("/materials/{material_id}")
@@ -1145,6 +2624,7 @@ async def delete_material(material_id: str):
     result = await db.materials.delete_one({"_id": ObjectId(material_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Material not found")
+    mark_collection_changed("materials", material_id)
     return {"message": "Material deleted successfully"}
 
 # =============== ONLINE TEST ROUTES ===============
@@ -1158,13 +2638,13 @@ async def create_test(test: OnlineTestCreate):
         "answer_key": True,
         "tags": [],
         "attempts_count": 1,
-        "feedback": [],
         "is_active": True,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
     result = await db.online_tests.insert_one(test_dict)
+    mark_collection_changed("online_tests", result.inserted_id)
     return {"message": "Test created", "id": str(result.inserted_id)}
 
 class TestWithQuestionsCreate(BaseModel):
@@ -1181,7 +2661,6 @@ async def create_test_with_questions(data: TestWithQuestionsCreate):
         "answer_key": True,
         "tags": [],
         "attempts_count": 1,
-        "feedback": [],
         "is_active": True,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
@@ -1206,27 +2685,50 @@ async def create_test_with_questions(data: TestWithQuestionsCreate):
     if questions_list:
         await db.test_questions.insert_many(questions_list)
     
+    mark_collection_changed("online_tests", test_id)
     return {"message": "Test with questions created", "test_id": test_id, "questions_count": len(questions_list)}
 
 @app.get("/tests")
-async def get_tests():
-    tests = []
-    async for test in db.online_tests.find():
+async def get_tests(page: PageParams = Depends(), fields: Optional[str] = None,
+                    sort: Optional[str] = None, min_rating: Optional[float] = None,
+                    stream: bool = Depends(wants_ndjson)):
+    projection = read_projection("online_tests", fields, for_list=True)
+    sort_field, direction = catalog_order(sort)
+    query = rating_filter(min_rating)
+
+    include_price = projection_includes(projection, "price")
+    attempts = await sharded_counters.transform("online_tests", "attempts_count", projection)
+
+    def normalize(test: dict) -> dict:
         # Ensure price field exists with default 0 for legacy records
-        if "price" not in test or test.get("price") is None:
+        if include_price and test.get("price") is None:
             test["price"] = 0
-        tests.append(serialize_object(test))
-    return {"tests": tests}
+        return attempts(test) if attempts else test
+
+    transform = normalize if include_price or attempts else None
+    if stream:
+        return stream_documents(db.online_tests, query, page, sort_field, direction,
+                                projection=projection, transform=transform)
+    tests, next_cursor = await fetch_page(db.online_tests, query, page, sort_field, direction, projection=projection)
+    if transform:
+        tests = [transform(test) for test in tests]
+    return page_response("tests", tests, next_cursor, page)
 
 @app.get("/tests/{test_id}")
-async def get_test(test_id: str):
-    test = await db.online_tests.find_one({"_id": ObjectId(test_id)})
+async def get_test(test_id: str, fields: Optional[str] = None):
+    projection = read_projection("online_tests", fields)
+    test = await db.online_tests.find_one({"_id": ObjectId(test_id)}, projection)
     if not test:
         raise HTTPException(status_code=404, detail="Test not found")
     # Ensure price field exists with default 0 for legacy records
-    if "price" not in test or test.get("price") is None:
+    if projection_includes(projection, "price") and test.get("price") is None:
         test["price"] = 0
-    return {"test": serialize_object(test)}
+    attempts = await sharded_counters.transform("online_tests", "attempts_count", projection)
+    if attempts:
+        attempts(test)
+    if projection_includes(projection, "feedback"):
+        test["feedback"] = await recent_reviews("test", test["_id"])
+    return {"test": test}
 
 @app.put("/tests/{test_id}")
 async def update_test(test_id: str, test_data: dict):
@@ -1237,6 +2739,7 @@ async def update_test(test_id: str, test_data: dict):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Test not found")
+    mark_collection_changed("online_tests", test_id)
     return {"message": "Test updated successfully"}
 
 @app.delete("/tests/{test_id}")
@@ -1244,6 +2747,8 @@ async def delete_test(test_id: str):
     result = await db.online_tests.delete_one({"_id": ObjectId(test_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Test not found")
+    await sharded_counters.discard("online_tests", test_id)
+    mark_collection_changed("online_tests", test_id)
     return {"message": "Test deleted successfully"}
 
 # =============== TEST QUESTION ROUTES ===============
@@ -1304,18 +2809,16 @@ async def create_question(
     return {"message": "Question created", "id": str(result.inserted_id)}
 
 @app.get("/test-questions/test/{test_id}")
-async def get_test_questions(test_id: str):
-    questions = []
-    async for question in db.test_questions.find({"test_id": ObjectId(test_id)}):
-        questions.append(serialize_object(question))
-    return {"questions": questions}
+async def get_test_questions(test_id: str, page: PageParams = Depends()):
+    questions, next_cursor = await fetch_page(db.test_questions, {"test_id": ObjectId(test_id)}, page)
+    return page_response("questions", questions, next_cursor, page)
 
 @app.get("/test-questions/{question_id}")
 async def get_question(question_id: str):
     question = await db.test_questions.find_one({"_id": ObjectId(question_id)})
     if not question:
         raise HTTPException(status_code=404, detail="Question not found")
-    return {"question": serialize_object(question)}
+    return {"question": question}
 
 @app.put("/test-questions/{question_id}")
 async def update_question(
@@ -1429,6 +2932,7 @@ async def start_test_attempt(test_id: str, user_id: str = Depends(get_current_us
     }
     
     result = await db.user_test_attempts.insert_one(attempt_dict)
+    await sharded_counters.increment("online_tests", test["_id"], "attempts_count")
     return {"message": "Test attempt started", "attempt_id": str(result.inserted_id)}
 
 @app.put("/test-attempts/{attempt_id}/answer")
@@ -1461,18 +2965,23 @@ async def complete_test_attempt(attempt_id: str):
     return {"message": "Test completed"}
 
 @app.get("/test-attempts/user/{user_id}")
-async def get_user_test_attempts(user_id: str):
-    attempts = []
-    async for attempt in db.user_test_attempts.find({"user_id": ObjectId(user_id)}):
-        attempts.append(serialize_object(attempt))
-    return {"attempts": attempts}
+async def get_user_test_attempts(user_id: str, page: PageParams = Depends(), fields: Optional[str] = None,
+                                 expand: Optional[str] = None, stream: bool = Depends(wants_ndjson),
+                                 loaders: RequestLoaders = Depends()):
+    expand_names = parse_expand(expand, ("user",), stream)
+    projection = read_projection("user_test_attempts", fields, for_list=True)
+    if stream:
+        return stream_documents(db.user_test_attempts, {"user_id": ObjectId(user_id)}, page, projection=projection)
+    attempts, next_cursor = await fetch_page(db.user_test_attempts, {"user_id": ObjectId(user_id)}, page, projection=projection)
+    await expand_documents(attempts, expand_names, loaders)
+    return page_response("attempts", attempts, next_cursor, page)
 
 @app.get("/test-attempts/{attempt_id}")
-async def get_test_attempt(attempt_id: str):
-    attempt = await db.user_test_attempts.find_one({"_id": ObjectId(attempt_id)})
+async def get_test_attempt(attempt_id: str, fields: Optional[str] = None):
+    attempt = await db.user_test_attempts.find_one({"_id": ObjectId(attempt_id)}, read_projection("user_test_attempts", fields))
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found")
-    return {"attempt": serialize_object(attempt)}
+    return {"attempt": attempt}
 
 # =============== NOTIFICATION ROUTES ===============
 
@@ -1491,18 +3000,18 @@ async def create_notification(notification: NotificationCreate):
     return {"message": "Notification created", "id": str(result.inserted_id)}
 
 @app.get("/notifications")
-async def get_notifications():
-    notifications = []
-    async for notif in db.notifications.find():
-        notifications.append(serialize_object(notif))
-    return {"notifications": notifications}
+async def get_notifications(page: PageParams = Depends(), stream: bool = Depends(wants_ndjson)):
+    if stream:
+        return stream_documents(db.notifications, {}, page)
+    notifications, next_cursor = await fetch_page(db.notifications, {}, page)
+    return page_response("notifications", notifications, next_cursor, page)
 
 @app.get("/notifications/{notification_id}")
 async def get_notification(notification_id: str):
     notification = await db.notifications.find_one({"_id": ObjectId(notification_id)})
     if not notification:
         raise HTTPException(status_code=404, detail="Notification not found")
-    return {"notification": serialize_object(notification)}
+    return {"notification": notification}
 
 @app.put("/notifications/{notification_id}")
 async def update_notification(notification_id: str, notification_data: dict):
@@ -1539,14 +3048,15 @@ async def create_current_affairs(affairs: CurrentAffairsCreate):
     }
     
     result = await db.current_affairs.insert_one(affairs_dict)
+    mark_collection_changed("current_affairs", result.inserted_id)
     return {"message": "Current affairs created", "id": str(result.inserted_id)}
 
 @app.get("/current-affairs")
-async def get_current_affairs():
-    affairs = []
-    async for affair in db.current_affairs.find():
-        affairs.append(serialize_object(affair))
-    return {"current_affairs": affairs}
+async def get_current_affairs(page: PageParams = Depends(), stream: bool = Depends(wants_ndjson)):
+    if stream:
+        return stream_documents(db.current_affairs, {}, page)
+    affairs, next_cursor = await fetch_page(db.current_affairs, {}, page)
+    return page_response("current_affairs", affairs, next_cursor, page)
 
 @app.get("/current-affairs/{affairs_id}")
 async def get_current_affair(affairs_id: str):
@@ -1555,12 +3065,9 @@ async def get_current_affair(affairs_id: str):
         raise HTTPException(status_code=404, detail="Current affairs not found")
     
     # Increment view count
-    await db.current_affairs.update_one(
-        {"_id": ObjectId(affairs_id)},
-        {"$inc": {"view_count": 1}}
-    )
+    counter_aggregator.increment("current_affairs", affair["_id"], "view_count")
     
-    return {"current_affairs": serialize_object(affair)}
+    return {"current_affairs": affair}
 
 @app.put("/current-affairs/{affairs_id}")
 async def update_current_affairs(affairs_id: str, affairs_data: dict):
@@ -1571,6 +3078,7 @@ async def update_current_affairs(affairs_id: str, affairs_data: dict):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Current affairs not found")
+    mark_collection_changed("current_affairs", affairs_id)
     return {"message": "Current affairs updated successfully"}
 
 @app.delete("/current-affairs/{affairs_id}")
@@ -1578,6 +3086,7 @@ async def delete_current_affairs(affairs_id: str):
     result = await db.current_affairs.delete_one({"_id": ObjectId(affairs_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Current affairs not found")
+    mark_collection_changed("current_affairs", affairs_id)
     return {"message": "Current affairs deleted successfully"}
 
 # =============== CONTACT ROUTES ===============
@@ -1592,6 +3101,7 @@ async def create_contact(contact_data: dict):
     }
     
     result = await db.contacts.insert_one(contact_dict)
+    mark_collection_changed("contacts")
     return {"message": "Contact info created", "id": str(result.inserted_id)}
 
 @app.get("/contact")
@@ -1599,7 +3109,7 @@ async def get_contact():
     contact = await db.contacts.find_one({"is_active": True})
     if not contact:
         raise HTTPException(status_code=404, detail="Contact info not found")
-    return {"contact": serialize_object(contact)}
+    return {"contact": contact}
 
 @app.put("/contact/{contact_id}")
 async def update_contact(contact_id: str, contact_data: dict):
@@ -1639,6 +3149,7 @@ async def update_contact(contact_id: str, contact_data: dict):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Contact not found")
+    mark_collection_changed("contacts")
     return {"message": "Contact updated successfully"}
 
 # =============== USER CONTACT MESSAGES ROUTES ===============
@@ -1657,18 +3168,18 @@ async def create_contact_message(message_data: dict):
     return {"message": "Contact message sent", "id": str(result.inserted_id)}
 
 @app.get("/contact-messages")
-async def get_contact_messages():
-    messages = []
-    async for message in db.user_contact_messages.find():
-        messages.append(serialize_object(message))
-    return {"messages": messages}
+async def get_contact_messages(page: PageParams = Depends(), stream: bool = Depends(wants_ndjson)):
+    if stream:
+        return stream_documents(db.user_contact_messages, {}, page)
+    messages, next_cursor = await fetch_page(db.user_contact_messages, {}, page)
+    return page_response("messages", messages, next_cursor, page)
 
 @app.get("/contact-messages/{message_id}")
 async def get_contact_message(message_id: str):
     message = await db.user_contact_messages.find_one({"_id": ObjectId(message_id)})
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
-    return {"message": serialize_object(message)}
+    return {"message": message}
 
 @app.put("/contact-messages/{message_id}")
 async def update_contact_message(message_id: str, message_data: dict):
@@ -1702,6 +3213,7 @@ async def create_terms_conditions(terms_data: dict):
     }
     
     result = await db.terms_conditions.insert_one(terms_dict)
+    mark_collection_changed("terms_conditions")
     return {"message": "Terms and conditions created", "id": str(result.inserted_id)}
 
 @app.get("/terms-conditions")
@@ -1709,14 +3221,14 @@ async def get_terms_conditions():
     terms = await db.terms_conditions.find_one({"is_active": True})
     if not terms:
         raise HTTPException(status_code=404, detail="Terms and conditions not found")
-    return {"terms": serialize_object(terms)}
+    return {"terms": terms}
 
 @app.get("/terms-conditions/{terms_id}")
 async def get_terms_by_id(terms_id: str):
     terms = await db.terms_conditions.find_one({"_id": ObjectId(terms_id)})
     if not terms:
         raise HTTPException(status_code=404, detail="Terms and conditions not found")
-    return {"terms": serialize_object(terms)}
+    return {"terms": terms}
 
 @app.put("/terms-conditions/{terms_id}")
 async def update_terms_conditions(terms_id: str, terms_data: dict):
@@ -1728,6 +3240,7 @@ async def update_terms_conditions(terms_id: str, terms_data: dict):
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Terms and conditions not found")
+    mark_collection_changed("terms_conditions")
     return {"message": "Terms and conditions updated successfully"}
 
 @app.delete("/terms-conditions/{terms_id}")
@@ -1735,78 +3248,63 @@ async def delete_terms_conditions(terms_id: str):
     result = await db.terms_conditions.delete_one({"_id": ObjectId(terms_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Terms and conditions not found")
+    mark_collection_changed("terms_conditions")
     return {"message": "Terms and conditions deleted successfully"}
 
 # =============== USER DOWNLOAD TRACKING ROUTES ===============
 
 @app.post("/downloads")
 async def track_download(download_data: dict, user_id: str = Depends(get_current_user)):
-    # Check if user already downloaded this material
-    existing_download = await db.user_downloads.find_one({
-        "user_id": ObjectId(user_id),
-        "material_id": ObjectId(download_data["material_id"])
-    })
-    
-    if existing_download:
-        # Update download count
-        await db.user_downloads.update_one(
-            {"_id": existing_download["_id"]},
-            {
-                "$inc": {"download_count": 1},
-                "$set": {"last_download_at": datetime.utcnow()}
-            }
-        )
-    else:
-        # Create new download record
-        download_dict = {
-            "user_id": ObjectId(user_id),
-            "material_id": ObjectId(download_data["material_id"]),
-            "download_count": 1,
-            "last_download_at": datetime.utcnow(),
+    material_id = ObjectId(download_data["material_id"])
+    now = datetime.utcnow()
+    key = {"user_id": ObjectId(user_id), "material_id": material_id}
+    update = {
+        "$inc": {"download_count": 1},
+        "$set": {"last_download_at": now},
+        "$setOnInsert": {
             "ip_address": download_data.get("ip_address"),
             "user_agent": download_data.get("user_agent"),
-            "created_at": datetime.utcnow()
+            "created_at": now
         }
-        await db.user_downloads.insert_one(download_dict)
-    
+    }
+    # One row per (user, material), guaranteed by the unique index
+    try:
+        await db.user_downloads.update_one(key, update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent first download inserted the row; count this one against it
+        await db.user_downloads.update_one(key, update)
+
     # Update material download count
-    await db.materials.update_one(
-        {"_id": ObjectId(download_data["material_id"])},
-        {"$inc": {"download_count": 1}}
-    )
+    counter_aggregator.increment("materials", material_id, "download_count")
     
     return {"message": "Download tracked successfully"}
 
 @app.get("/downloads/user/{user_id}")
-async def get_user_downloads(user_id: str):
-    downloads = []
-    async for download in db.user_downloads.find({"user_id": ObjectId(user_id)}):
-        downloads.append(serialize_object(download))
-    return {"downloads": downloads}
+async def get_user_downloads(user_id: str, page: PageParams = Depends(), expand: Optional[str] = None,
+                             stream: bool = Depends(wants_ndjson), loaders: RequestLoaders = Depends()):
+    expand_names = parse_expand(expand, ("user",), stream)
+    if stream:
+        return stream_documents(db.user_downloads, {"user_id": ObjectId(user_id)}, page)
+    downloads, next_cursor = await fetch_page(db.user_downloads, {"user_id": ObjectId(user_id)}, page)
+    await expand_documents(downloads, expand_names, loaders)
+    return page_response("downloads", downloads, next_cursor, page)
 
 @app.get("/downloads/material/{material_id}")
-async def get_material_downloads(material_id: str):
-    downloads = []
-    async for download in db.user_downloads.find({"material_id": ObjectId(material_id)}):
-        downloads.append(serialize_object(download))
-    return {"downloads": downloads}
+async def get_material_downloads(material_id: str, page: PageParams = Depends(), expand: Optional[str] = None,
+                                 stream: bool = Depends(wants_ndjson), loaders: RequestLoaders = Depends()):
+    expand_names = parse_expand(expand, ("user",), stream)
+    if stream:
+        return stream_documents(db.user_downloads, {"material_id": ObjectId(material_id)}, page)
+    downloads, next_cursor = await fetch_page(db.user_downloads, {"material_id": ObjectId(material_id)}, page)
+    await expand_documents(downloads, expand_names, loaders)
+    return page_response("downloads", downloads, next_cursor, page)
 
 # =============== USER ENROLLMENT ROUTES ===============
 
 @app.post("/enrollments")
 async def enroll_user_in_course(enrollment_data: dict, user_id: str = Depends(get_current_user)):
-    # Check if user already enrolled
-    existing_enrollment = await db.user_enrollments.find_one({
-        "user_id": ObjectId(user_id),
-        "course_id": ObjectId(enrollment_data["course_id"])
-    })
-    
-    if existing_enrollment:
-        raise HTTPException(status_code=400, detail="User already enrolled in this course")
-    
+    course_id = ObjectId(enrollment_data["course_id"])
     enrollment_dict = {
-        "user_id": ObjectId(user_id),
-        "course_id": ObjectId(enrollment_data["course_id"]),
         "enrollment_date": datetime.utcnow(),
         "status": "active",
         "progress": 0,
@@ -1817,36 +3315,49 @@ async def enroll_user_in_course(enrollment_data: dict, user_id: str = Depends(ge
         "updated_at": datetime.utcnow()
     }
     
-    result = await db.user_enrollments.insert_one(enrollment_dict)
+    # Insert only if the user is not enrolled yet; the unique index settles concurrent taps
+    try:
+        result = await db.user_enrollments.update_one(
+            {"user_id": ObjectId(user_id), "course_id": course_id},
+            {"$setOnInsert": enrollment_dict},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        result = None
+    if result is None or result.upserted_id is None:
+        raise HTTPException(status_code=400, detail="User already enrolled in this course")
     
     # Update course enrolled students count
-    await db.courses.update_one(
-        {"_id": ObjectId(enrollment_data["course_id"])},
-        {"$inc": {"enrolled_students": 1}}
-    )
+    await sharded_counters.increment("courses", course_id, "enrolled_students")
     
-    return {"message": "User enrolled successfully", "enrollment_id": str(result.inserted_id)}
+    return {"message": "User enrolled successfully", "enrollment_id": str(result.upserted_id)}
 
 @app.get("/enrollments/user/{user_id}")
-async def get_user_enrollments(user_id: str):
-    enrollments = []
-    async for enrollment in db.user_enrollments.find({"user_id": ObjectId(user_id)}):
-        enrollments.append(serialize_object(enrollment))
-    return {"enrollments": enrollments}
+async def get_user_enrollments(user_id: str, page: PageParams = Depends(), expand: Optional[str] = None,
+                               stream: bool = Depends(wants_ndjson), loaders: RequestLoaders = Depends()):
+    expand_names = parse_expand(expand, ("user", "course"), stream)
+    if stream:
+        return stream_documents(db.user_enrollments, {"user_id": ObjectId(user_id)}, page)
+    enrollments, next_cursor = await fetch_page(db.user_enrollments, {"user_id": ObjectId(user_id)}, page)
+    await expand_documents(enrollments, expand_names, loaders)
+    return page_response("enrollments", enrollments, next_cursor, page)
 
 @app.get("/enrollments/course/{course_id}")
-async def get_course_enrollments(course_id: str):
-    enrollments = []
-    async for enrollment in db.user_enrollments.find({"course_id": ObjectId(course_id)}):
-        enrollments.append(serialize_object(enrollment))
-    return {"enrollments": enrollments}
+async def get_course_enrollments(course_id: str, page: PageParams = Depends(), expand: Optional[str] = None,
+                                 stream: bool = Depends(wants_ndjson), loaders: RequestLoaders = Depends()):
+    expand_names = parse_expand(expand, ("user", "course"), stream)
+    if stream:
+        return stream_documents(db.user_enrollments, {"course_id": ObjectId(course_id)}, page)
+    enrollments, next_cursor = await fetch_page(db.user_enrollments, {"course_id": ObjectId(course_id)}, page)
+    await expand_documents(enrollments, expand_names, loaders)
+    return page_response("enrollments", enrollments, next_cursor, page)
 
 @app.get("/enrollments/{enrollment_id}")
 async def get_enrollment(enrollment_id: str):
     enrollment = await db.user_enrollments.find_one({"_id": ObjectId(enrollment_id)})
     if not enrollment:
         raise HTTPException(status_code=404, detail="Enrollment not found")
-    return {"enrollment": serialize_object(enrollment)}
+    return {"enrollment": enrollment}
 
 @app.put("/enrollments/{enrollment_id}")
 async def update_enrollment(enrollment_id: str, enrollment_data: dict):
@@ -1897,19 +3408,26 @@ async def get_dashboard_stats():
     }
 
 @app.get("/dashboard/recent-activities")
-async def get_recent_activities():
+async def get_recent_activities(expand: Optional[str] = None, loaders: RequestLoaders = Depends()):
     # Get recent activities
     recent_users = []
-    async for user in db.users.find().sort("created_at", -1).limit(5):
-        recent_users.append(serialize_object(user))
+    async for user in db.users.find({}, read_projection("users", for_list=True)).sort("created_at", -1).limit(5):
+        recent_users.append(user)
     
     recent_enrollments = []
     async for enrollment in db.user_enrollments.find().sort("created_at", -1).limit(5):
-        recent_enrollments.append(serialize_object(enrollment))
+        recent_enrollments.append(enrollment)
     
     recent_test_attempts = []
     async for attempt in db.user_test_attempts.find().sort("created_at", -1).limit(5):
-        recent_test_attempts.append(serialize_object(attempt))
+        recent_test_attempts.append(attempt)
+
+    # Enrollments and attempts share one user query (and one course query)
+    expand_names = parse_expand(expand, ("user", "course"))
+    await asyncio.gather(
+        expand_documents(recent_enrollments, expand_names, loaders),
+        expand_documents(recent_test_attempts, [name for name in expand_names if name != "course"], loaders),
+    )
     
     return {
         "recent_users": recent_users,
@@ -1935,153 +3453,778 @@ async def update_dual_login_state(update: DualLoginUpdate):
     DUAL_LOGIN_ENABLED = update.duallogin
     return {"message": "Dual login state updated", "duallogin": DUAL_LOGIN_ENABLED}
 
+# =============== CATALOG SEARCH INDEX ===============
+
+# Searchable collections: text fields with their term weights, ?filter= names
+# mapped to document fields, and the field shown as the result title
+CATALOG_SEARCH_SOURCES = {
+    "courses": {
+        "type": "course",
+        "title": "title",
+        "fields": {"name": 3, "title": 3, "category": 2, "sub_category": 2, "instructor": 1, "description": 1},
+        "filters": {"category": "category"},
+    },
+    "materials": {
+        "type": "material",
+        "title": "title",
+        "fields": {"title": 3, "subject": 2, "course": 2, "sub_category": 2, "class_name": 1, "module": 1,
+                   "tags": 1, "description": 1},
+        "filters": {"course": "course"},
+    },
+    "online_tests": {
+        "type": "test",
+        "title": "test_title",
+        "fields": {"test_title": 3, "subject": 2, "course": 2, "sub_category": 2, "class_name": 1, "module": 1,
+                   "description": 1},
+        "filters": {"course": "course", "difficulty": "difficulty_level"},
+    },
+    "current_affairs": {
+        "type": "current_affair",
+        "title": "title",
+        "fields": {"title": 3, "category": 2, "tags": 1, "content": 1},
+        "filters": {"category": "category"},
+    },
+}
+
+SEARCH_STOPWORDS = frozenset({"a", "an", "and", "for", "in", "of", "on", "the", "to", "with"})
+# Ordinals in course names ("2nd PUC", "Second PUC") index like roman numerals ("II PUC")
+SEARCH_SYNONYMS = {"1st": "i", "first": "i", "2nd": "ii", "second": "ii", "3rd": "iii", "third": "iii"}
+_SEARCH_WORD = re.compile(r"[a-z0-9]+")
+
+def search_tokens(text: str) -> List[str]:
+    """
+    Tokens for the catalog index. Dotted abbreviations are joined ("C.A." -> "ca"),
+    short exam terms such as "ii", "ca" and "kpsc" are kept, simple plurals are
+    stripped, and adjacent words are added as phrase tokens ("ii_puc", "ca_inter")
+    so multi-word exam names outrank scattered matches.
+    """
+    words = []
+    for word in _SEARCH_WORD.findall(text.lower().replace(".", "")):
+        word = SEARCH_SYNONYMS.get(word, word)
+        if word in SEARCH_STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words + [f"{first}_{second}" for first, second in zip(words, words[1:])]
+
+def _bit_positions(bits: int) -> set:
+    """Doc numbers set in a filter bitset"""
+    digits = bin(bits)[:1:-1]
+    positions = set()
+    position = digits.find("1")
+    while position != -1:
+        positions.add(position)
+        position = digits.find("1", position + 1)
+    return positions
+
+def _field_text(value: Any) -> str:
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value)
+    return str(value) if value is not None else ""
+
+class CollectionIndex:
+    """
+    Base for in-memory indexes over catalog collections. mark_collection_changed
+    listeners call mark_changed, which queues the written _ids (None for a whole
+    collection) for one background task that hands them to _apply. Rebuilds and
+    refreshes share a lock, so documents written during a rebuild are re-read
+    after it. run() retries a failed build with backoff and otherwise rebuilds
+    every rebuild_seconds. Subclasses implement _rebuild and _apply.
+    """
+
+    label = "index"
+    RETRY_MAX_SECONDS = 60
+
+    def __init__(self, sources: Dict[str, dict], rebuild_seconds: int):
+        self.sources = sources
+        self.rebuild_seconds = rebuild_seconds
+        self.ready = False
+        self._lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[str, Optional[set]] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        self.builds = 0
+        self.updates = 0
+        self.last_build_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            # Created on first use so it binds to the running event loop
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _rebuild(self):
+        raise NotImplementedError
+
+    async def _apply(self, collection_name: str, doc_ids: Optional[set]):
+        raise NotImplementedError
+
+    async def build(self):
+        async with self._get_lock():
+            started = time.perf_counter()
+            await self._rebuild()
+            self.ready = True
+            self.builds += 1
+            self.last_build_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def mark_changed(self, collection_name: str, doc_ids: tuple):
+        """Queue written documents (or the whole collection when no ids are given) for re-indexing"""
+        if collection_name not in self.sources:
+            return
+        if not doc_ids:
+            self._pending[collection_name] = None
+        elif self._pending.get(collection_name, set()) is not None:
+            self._pending.setdefault(collection_name, set()).update(ObjectId(doc_id) for doc_id in doc_ids)
+        if self._refresher is None or self._refresher.done():
+            self._refresher = spawn_background(self._refresh(), name=f"{self.label} refresh")
+
+    async def _refresh(self):
+        # Documents marked while a re-read or a rebuild is in flight are re-read afterwards;
+        # a failed re-read is repaired by the next rebuild
+        while self._pending:
+            async with self._get_lock():
+                pending, self._pending = self._pending, {}
+                for collection_name, doc_ids in pending.items():
+                    try:
+                        await self._apply(collection_name, doc_ids)
+                        self.updates += 1
+                    except Exception as e:
+                        print(f"Error updating {self.label} for {collection_name}: {str(e)}")
+
+    async def run(self):
+        """Build the index, retrying with backoff until it succeeds, then rebuild it every rebuild_seconds"""
+        retry_seconds = 1
+        while True:
+            try:
+                await self.build()
+                if self.builds == 1 or self.last_error:
+                    print(f"Built {self.label} in {self.last_build_ms} ms")
+                self.last_error = None
+                delay, retry_seconds = self.rebuild_seconds, 1
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error building {self.label}, retrying in {retry_seconds}s: {str(e)}")
+                delay, retry_seconds = retry_seconds, min(retry_seconds * 2, self.RETRY_MAX_SECONDS)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "rebuild_seconds": self.rebuild_seconds,
+            "builds": self.builds,
+            "last_build_ms": self.last_build_ms,
+            "last_error": self.last_error,
+            "updates": self.updates,
+            "pending": len(self._pending),
+        }
+
+class CatalogSearchIndex(CollectionIndex):
+    """
+    In-process inverted index over courses, materials, tests and current affairs,
+    ranked with BM25. Postings map token -> {doc number: weighted term frequency}
+    and filters are int bitsets over doc numbers, so a search never queries Mongo.
+    Doc numbers of removed documents are reused to keep the bitsets narrow, and
+    BM25 length norms are recomputed once after a batch of writes rather than
+    per search. Written documents are re-read and swapped into the index in place.
+    """
+
+    label = "catalog search index"
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, sources: Dict[str, dict], rebuild_seconds: int):
+        super().__init__(sources, rebuild_seconds)
+        self._numbers: Dict[tuple, int] = {}
+        self._free_numbers: List[int] = []
+        self._next_number = 0
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_lengths: Dict[int, float] = {}
+        self._total_length = 0.0
+        self._length_norms: Optional[Dict[int, float]] = None
+        self._bitsets: Dict[tuple, int] = {}
+        self._doc_filters: Dict[int, List[tuple]] = {}
+        self._results: Dict[int, dict] = {}
+        self.searches = 0
+
+    def add(self, collection_name: str, doc: dict):
+        source = self.sources[collection_name]
+        self.remove(collection_name, doc["_id"])
+        if self._free_numbers:
+            number = self._free_numbers.pop()
+        else:
+            number = self._next_number
+            self._next_number += 1
+        self._numbers[(collection_name, doc["_id"])] = number
+
+        terms: Dict[str, float] = {}
+        for field, weight in source["fields"].items():
+            for token in search_tokens(_field_text(doc.get(field))):
+                terms[token] = terms.get(token, 0.0) + weight
+        for token, frequency in terms.items():
+            self._postings.setdefault(token, {})[number] = frequency
+        self._doc_terms[number] = terms
+        self._doc_lengths[number] = sum(terms.values())
+        self._total_length += self._doc_lengths[number]
+        self._length_norms = None
+
+        filters = [("type", source["type"])] + [
+            (name, str(doc[field]).lower()) for name, field in source["filters"].items() if doc.get(field)
+        ]
+        for key in filters:
+            self._bitsets[key] = self._bitsets.get(key, 0) | (1 << number)
+        self._doc_filters[number] = filters
+        self._results[number] = {
+            "type": source["type"],
+            "_id": doc["_id"],
+            "title": doc.get(source["title"]),
+            **{name: doc.get(field) for name, field in source["filters"].items()},
+        }
+
+    def remove(self, collection_name: str, doc_id: ObjectId):
+        number = self._numbers.pop((collection_name, doc_id), None)
+        if number is None:
+            return
+        for token in self._doc_terms.pop(number):
+            postings = self._postings[token]
+            del postings[number]
+            if not postings:
+                del self._postings[token]
+        self._total_length -= self._doc_lengths.pop(number)
+        for key in self._doc_filters.pop(number):
+            self._bitsets[key] &= ~(1 << number)
+        del self._results[number]
+        self._free_numbers.append(number)
+        self._length_norms = None
+
+    def search(self, query: str, filters: Dict[str, Optional[str]], limit: int = 20) -> List[dict]:
+        self.searches += 1
+        tokens = set(search_tokens(query))
+        if not tokens or not self._doc_lengths:
+            return []
+        mask = None
+        for name, value in filters.items():
+            if value:
+                bits = self._bitsets.get((name, value.lower()), 0)
+                mask = bits if mask is None else mask & bits
+        if mask == 0:
+            return []
+        allowed = _bit_positions(mask) if mask is not None else None
+
+        doc_count = len(self._doc_lengths)
+        length_norms = self._length_norms
+        if length_norms is None:
+            average_length = self._total_length / doc_count or 1.0
+            length_norms = self._length_norms = {
+                number: self.K1 * (1 - self.B + self.B * length / average_length)
+                for number, length in self._doc_lengths.items()
+            }
+        scores: Dict[int, float] = {}
+        for token in tokens:
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5)) * (self.K1 + 1)
+            for number, frequency in postings.items():
+                if allowed is not None and number not in allowed:
+                    continue
+                scores[number] = scores.get(number, 0.0) + idf * frequency / (frequency + length_norms[number])
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [{**self._results[number], "score": round(score, 4)} for number, score in top]
+
+    async def _rebuild(self):
+        # Rebuilt in place: every document is re-added and the ones no longer found removed
+        for collection_name in self.sources:
+            await self._apply(collection_name, None)
+
+    async def _apply(self, collection_name: str, doc_ids: Optional[set]):
+        source = self.sources[collection_name]
+        projection = {field: 1 for field in [*source["fields"], *source["filters"].values(), source["title"]]}
+        if doc_ids is None:
+            query = {}
+            expected = {doc_id for name, doc_id in self._numbers if name == collection_name}
+        else:
+            query = {"_id": {"$in": list(doc_ids)}}
+            expected = set(doc_ids)
+        async for doc in db[collection_name].find(query, projection):
+            self.add(collection_name, doc)
+            expected.discard(doc["_id"])
+        # Whatever was expected but not read back has been deleted
+        for doc_id in expected:
+            self.remove(collection_name, doc_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "documents": len(self._doc_lengths),
+            "terms": len(self._postings),
+            "searches": self.searches,
+        }
+
+catalog_search = CatalogSearchIndex(CATALOG_SEARCH_SOURCES, CATALOG_SEARCH_REBUILD_SECONDS)
+collection_change_listeners.append(catalog_search.mark_changed)
+
+# =============== SEARCH SUGGESTIONS ===============
+
+# Suggestion sources: titles shown as suggestions, the counter used as their
+# popularity (and whether it is sharded), and the field listed as a subject
+SUGGEST_SOURCES = {
+    "courses": {"type": "course", "fields": ("name", "title"), "popularity": "enrolled_students", "sharded": True},
+    "online_tests": {"type": "test", "fields": ("test_title",), "popularity": "attempts_count", "sharded": True,
+                     "subject": "subject"},
+    "materials": {"type": "material", "fields": ("title",), "popularity": "download_count", "sharded": False,
+                  "subject": "subject"},
+}
+
+def suggest_key(text: Any) -> str:
+    """Lowercased words joined by single spaces, the form suggestions are matched on"""
+    return " ".join(_SEARCH_WORD.findall(str(text).lower()))
+
+class SuggestIndex(CollectionIndex):
+    """
+    Prefix autocomplete over catalog titles and subjects. Every word position of
+    a title is a key in one sorted list, so "phy" finds "II PUC Physics", and a
+    prefix matches the bisect range [prefix, prefix + "\\uffff"). Matches rank by
+    popularity: enrollments, attempts or downloads, summed over the documents of
+    a subject. Suggestions for prefixes of up to precomputed_length characters
+    are kept ranked, since those ranges cover most of the catalog. Periodic
+    rebuilds pick up counter changes, which do not go through mark_collection_changed.
+    """
+
+    label = "search suggestions"
+
+    def __init__(self, sources: Dict[str, dict], max_results: int, precomputed_length: int, rebuild_seconds: int):
+        super().__init__(sources, rebuild_seconds)
+        self.max_results = max_results
+        self.precomputed_length = precomputed_length
+        self._reset()
+        self.suggestions = 0
+
+    def _reset(self):
+        self._keys: List[tuple] = []
+        self._entries: Dict[int, dict] = {}
+        self._entry_numbers: Dict[tuple, int] = {}
+        self._next_number = 0
+        self._doc_entries: Dict[tuple, tuple] = {}
+        self._subject_members: Dict[tuple, int] = {}
+        self._top: Dict[str, List[int]] = {}
+
+    def _prefixes(self, key: str) -> set:
+        """Precomputed prefixes whose ranges include the word positions of `key`"""
+        words = key.split(" ")
+        positions = [" ".join(words[i:]) for i in range(len(words))]
+        return {position[:n] for position in positions for n in range(1, self.precomputed_length + 1)}
+
+    def _add_entry(self, natural_key: tuple, text: str, popularity: int, result: dict, sort: bool = True) -> set:
+        key = natural_key[-1]
+        number = self._entry_numbers.get(natural_key)
+        if number is not None:
+            # Subjects are shared; each document adds its popularity
+            self._entries[number]["popularity"] += popularity
+            self._subject_members[natural_key] += 1
+            return self._prefixes(key)
+        number = self._entry_numbers[natural_key] = self._next_number
+        self._next_number += 1
+        self._entries[number] = {"text": text, **result, "popularity": popularity}
+        if natural_key[0] == "subject":
+            self._subject_members[natural_key] = 1
+        words = key.split(" ")
+        for i in range(len(words)):
+            if sort:
+                bisect.insort(self._keys, (" ".join(words[i:]), number))
+            else:
+                self._keys.append((" ".join(words[i:]), number))
+        return self._prefixes(key)
+
+    def _remove_entry(self, natural_key: tuple, popularity: int) -> set:
+        key = natural_key[-1]
+        number = self._entry_numbers[natural_key]
+        if natural_key[0] == "subject":
+            self._entries[number]["popularity"] -= popularity
+            self._subject_members[natural_key] -= 1
+            if self._subject_members[natural_key]:
+                return self._prefixes(key)
+            del self._subject_members[natural_key]
+        words = key.split(" ")
+        for i in range(len(words)):
+            position = bisect.bisect_left(self._keys, (" ".join(words[i:]), number))
+            del self._keys[position]
+        del self._entries[number]
+        del self._entry_numbers[natural_key]
+        return self._prefixes(key)
+
+    def add(self, collection_name: str, doc: dict, popularity: int, sort: bool = True) -> set:
+        """Index one document, replacing its previous suggestions; returns the precomputed prefixes touched"""
+        source = self.sources[collection_name]
+        touched = self.remove(collection_name, doc["_id"])
+        natural_keys = []
+        for field in source["fields"]:
+            key = suggest_key(doc.get(field) or "")
+            natural_key = (source["type"], doc["_id"], key)
+            if key and natural_key not in natural_keys:
+                touched |= self._add_entry(natural_key, str(doc[field]).strip(), popularity,
+                                           {"type": source["type"], "_id": doc["_id"]}, sort)
+                natural_keys.append(natural_key)
+        subject = doc.get(source.get("subject")) if source.get("subject") else None
+        key = suggest_key(subject or "")
+        if key:
+            natural_key = ("subject", key)
+            touched |= self._add_entry(natural_key, str(subject).strip(), popularity, {"type": "subject"}, sort)
+            natural_keys.append(natural_key)
+        self._doc_entries[(collection_name, doc["_id"])] = (natural_keys, popularity)
+        return touched
+
+    def remove(self, collection_name: str, doc_id: ObjectId) -> set:
+        natural_keys, popularity = self._doc_entries.pop((collection_name, doc_id), ([], 0))
+        touched = set()
+        for natural_key in natural_keys:
+            touched |= self._remove_entry(natural_key, popularity)
+        return touched
+
+    def _range(self, prefix: str) -> set:
+        start = bisect.bisect_left(self._keys, (prefix,))
+        end = bisect.bisect_left(self._keys, (prefix + "\uffff",), start)
+        return {number for _, number in self._keys[start:end]}
+
+    def _rank(self, numbers, limit: int) -> List[int]:
+        entries = self._entries
+        return heapq.nlargest(limit, numbers, key=lambda n: (entries[n]["popularity"], -len(entries[n]["text"])))
+
+    def _precompute(self, prefixes):
+        for prefix in prefixes:
+            numbers = self._range(prefix)
+            if numbers:
+                self._top[prefix] = self._rank(numbers, self.max_results)
+            else:
+                self._top.pop(prefix, None)
+
+    def suggest(self, query: str, limit: int) -> List[dict]:
+        self.suggestions += 1
+        prefix = suggest_key(query)
+        if not prefix:
+            return []
+        if query[-1:].isspace():
+            # "ii " should not also match "iit"
+            prefix += " "
+        limit = max(1, min(limit, self.max_results))
+        if len(prefix) <= self.precomputed_length:
+            numbers = self._top.get(prefix, [])[:limit]
+        else:
+            numbers = self._rank(self._range(prefix), limit)
+        return [dict(self._entries[number]) for number in numbers]
+
+    async def _read(self, collection_name: str, doc_ids: Optional[set] = None) -> List[tuple]:
+        """(document, popularity) pairs, with sharded counter totals added"""
+        source = self.sources[collection_name]
+        projection = {field: 1 for field in [*source["fields"], source["popularity"], source.get("subject")] if field}
+        query = {"_id": {"$in": list(doc_ids)}} if doc_ids is not None else {}
+        shard_totals = {}
+        if source["sharded"]:
+            shard_totals = await sharded_counters.totals(collection_name, source["popularity"])
+        docs = await db[collection_name].find(query, projection).to_list(length=None)
+        return [(doc, (doc.get(source["popularity"]) or 0) + shard_totals.get(doc["_id"], 0)) for doc in docs]
+
+    async def _rebuild(self):
+        loaded = {collection_name: await self._read(collection_name) for collection_name in self.sources}
+        # Swapped in without awaiting, so suggestions never see a half-built index
+        self._reset()
+        for collection_name, docs in loaded.items():
+            for doc, popularity in docs:
+                self.add(collection_name, doc, popularity, sort=False)
+        self._keys.sort()
+        groups: Dict[str, set] = {}
+        for key, number in self._keys:
+            for n in range(1, self.precomputed_length + 1):
+                groups.setdefault(key[:n], set()).add(number)
+        self._top = {prefix: self._rank(numbers, self.max_results) for prefix, numbers in groups.items()}
+
+    async def _apply(self, collection_name: str, doc_ids: Optional[set]):
+        docs = await self._read(collection_name, doc_ids)
+        if doc_ids is None:
+            expected = {doc_id for name, doc_id in self._doc_entries if name == collection_name}
+        else:
+            expected = set(doc_ids)
+        touched = set()
+        for doc, popularity in docs:
+            touched |= self.add(collection_name, doc, popularity)
+            expected.discard(doc["_id"])
+        # Whatever was expected but not read back has been deleted
+        for doc_id in expected:
+            touched |= self.remove(collection_name, doc_id)
+        self._precompute(touched)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "suggestions": len(self._entries),
+            "keys": len(self._keys),
+            "precomputed_prefixes": len(self._top),
+            "requests": self.suggestions,
+        }
+
+suggest_index = SuggestIndex(SUGGEST_SOURCES, SUGGEST_MAX_RESULTS, SUGGEST_PRECOMPUTED_PREFIX_LENGTH,
+                             SUGGEST_REBUILD_SECONDS)
+collection_change_listeners.append(suggest_index.mark_changed)
+
 # =============== SEARCH ROUTES ===============
 
-@app.get("/search/courses")
-async def search_courses(query: str = "", category: str = "", limit: int = 10):
-    filter_dict = {}
-    
+def search_cursor(collection, query: str, filters: dict, sort: Optional[str] = None, limit: int = 10):
+    """
+    Cursor for a /search route. A query runs against the collection's weighted
+    text index and is ordered by textScore unless ?sort= is given; filters are
+    equality predicates, and empty filter values are ignored.
+    """
+    filter_dict = {field: value for field, value in filters.items() if value not in (None, "")}
+    projection = None
     if query:
-        filter_dict["$or"] = [
-            {"name": {"$regex": query, "$options": "i"}},
-            {"title": {"$regex": query, "$options": "i"}},
-            {"description": {"$regex": query, "$options": "i"}}
-        ]
-    
-    if category:
-        filter_dict["category"] = category
-    
+        filter_dict["$text"] = {"$search": query}
+        projection = {"score": {"$meta": "textScore"}}
+    if query and not sort:
+        order = [("score", {"$meta": "textScore"})]
+    else:
+        sort_field, direction = catalog_order(sort)
+        order = [("_id", direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+    return collection.find(filter_dict, projection).sort(order).limit(limit)
+
+@app.get("/search/catalog")
+async def search_catalog(q: str, entity_type: Optional[str] = Query(None, alias="type"),
+                         category: Optional[str] = None, course: Optional[str] = None,
+                         difficulty: Optional[str] = None, limit: int = 20):
+    """BM25-ranked search over courses, materials, tests and current affairs, served from memory"""
+    if not catalog_search.ready:
+        raise HTTPException(status_code=503, detail="Search index is still loading")
+    started = time.perf_counter()
+    filters = {"type": entity_type, "category": category, "course": course, "difficulty": difficulty}
+    results = catalog_search.search(q, filters, max(1, min(limit, 100)))
+    return {"results": results, "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+@app.get("/search/suggest")
+async def search_suggest(q: str, limit: int = 8):
+    """Prefix suggestions for the search box, most popular first, served from memory"""
+    if not suggest_index.ready:
+        raise HTTPException(status_code=503, detail="Suggestions are still loading")
+    started = time.perf_counter()
+    suggestions = suggest_index.suggest(q, limit)
+    return {"suggestions": suggestions, "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+@app.get("/search/courses")
+async def search_courses(query: str = "", category: str = "", min_rating: Optional[float] = None,
+                         sort: Optional[str] = None, limit: int = 10):
+    filters = {**rating_filter(min_rating), "category": category}
+    enrolled = await sharded_counters.transform("courses", "enrolled_students")
     courses = []
-    async for course in db.courses.find(filter_dict).limit(limit):
-        courses.append(serialize_object(course))
+    async for course in search_cursor(db.courses, query, filters, sort, limit):
+        courses.append(enrolled(course))
     
     return {"courses": courses}
 
 @app.get("/search/materials")
-async def search_materials(query: str = "", sub_category: str = "", course: str = "", limit: int = 10):
-    filter_dict = {}
-    
-    if query:
-        filter_dict["$or"] = [
-            {"title": {"$regex": query, "$options": "i"}},
-            {"description": {"$regex": query, "$options": "i"}},
-            {"sub_category": {"$regex": query, "$options": "i"}}
-        ]
-    
-    if sub_category:
-        filter_dict["sub_category"] = sub_category
-    
-    if course:
-        filter_dict["course"] = course
-    
+async def search_materials(query: str = "", sub_category: str = "", course: str = "",
+                           min_rating: Optional[float] = None, sort: Optional[str] = None, limit: int = 10):
+    filters = {**rating_filter(min_rating), "sub_category": sub_category, "course": course}
     materials = []
-    async for material in db.materials.find(filter_dict).limit(limit):
-        materials.append(serialize_object(material))
+    async for material in search_cursor(db.materials, query, filters, sort, limit):
+        materials.append(material)
     
     return {"materials": materials}
 
 @app.get("/search/tests")
-async def search_tests(query: str = "", subject: str = "", difficulty: str = "", limit: int = 10):
-    filter_dict = {}
-    
-    if query:
-        filter_dict["$or"] = [
-            {"test_title": {"$regex": query, "$options": "i"}},
-            {"description": {"$regex": query, "$options": "i"}},
-            {"subject": {"$regex": query, "$options": "i"}}
-        ]
-    
-    if subject:
-        filter_dict["subject"] = subject
-    
-    if difficulty:
-        filter_dict["difficulty_level"] = difficulty
-    
+async def search_tests(query: str = "", subject: str = "", difficulty: str = "",
+                       min_rating: Optional[float] = None, sort: Optional[str] = None, limit: int = 10):
+    filters = {**rating_filter(min_rating), "subject": subject, "difficulty_level": difficulty}
+    attempts = await sharded_counters.transform("online_tests", "attempts_count")
     tests = []
-    async for test in db.online_tests.find(filter_dict).limit(limit):
-        tests.append(serialize_object(test))
+    async for test in search_cursor(db.online_tests, query, filters, sort, limit):
+        tests.append(attempts(test))
     
     return {"tests": tests}
 
-# =============== FEEDBACK ROUTES ===============
+# =============== FEEDBACK / REVIEW ROUTES ===============
+
+# Reviewable entity types and the collections holding them
+REVIEW_ENTITY_COLLECTIONS = {"course": "courses", "test": "online_tests", "material": "materials"}
+
+RATING_VALUES = range(1, 6)
+
+def rating_summary_update(rating: int) -> List[dict]:
+    """
+    Pipeline update folding one rating into rating_summary: count, sum,
+    average and a 1-5 histogram, all recomputed atomically on the server
+    """
+    def current(field: str) -> dict:
+        return {"$ifNull": [f"$rating_summary.{field}", 0]}
+
+    count = {"$add": [current("count"), 1]}
+    total = {"$add": [current("sum"), rating]}
+    return [{"$set": {"rating_summary": {
+        "count": count,
+        "sum": total,
+        "average": {"$round": [{"$divide": [total, count]}, 2]},
+        "histogram": {"$mergeObjects": [
+            {str(r): 0 for r in RATING_VALUES},
+            {"$ifNull": ["$rating_summary.histogram", {}]},
+            {str(rating): {"$add": [current(f"histogram.{rating}"), 1]}},
+        ]},
+    }}}]
+
+def empty_rating_summary() -> dict:
+    return {"count": 0, "sum": 0, "average": None, "histogram": {str(r): 0 for r in RATING_VALUES}}
+
+def parse_rating(value: Any) -> Optional[int]:
+    """Rating from a feedback body; None for comment-only feedback (no rating, or the legacy 0)"""
+    if value is None or value == "":
+        return None
+    try:
+        rating = float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="rating must be a whole number from 1 to 5")
+    if rating == 0:
+        return None
+    if not rating.is_integer() or int(rating) not in RATING_VALUES:
+        raise HTTPException(status_code=400, detail="rating must be a whole number from 1 to 5")
+    return int(rating)
+
+async def add_review(entity_type: str, entity_id: str, user_id: str, feedback_data: dict,
+                     loaders: RequestLoaders) -> bool:
+    """
+    Store a review and fold its rating, if any, into the parent's rating_summary.
+    Returns False when the parent document does not exist.
+    """
+    collection_name = REVIEW_ENTITY_COLLECTIONS[entity_type]
+    rating = parse_rating(feedback_data.get("rating"))
+    if rating is None:
+        # Comment-only feedback is stored with rating 0, as before, and left out of the summary
+        if not await db[collection_name].find_one({"_id": ObjectId(entity_id)}, {"_id": 1}):
+            return False
+    else:
+        result = await db[collection_name].update_one({"_id": ObjectId(entity_id)}, rating_summary_update(rating))
+        if result.matched_count == 0:
+            return False
 
-@app.post("/feedback/material/{material_id}")
-async def add_material_feedback(material_id: str, feedback_data: dict, user_id: str = Depends(get_current_user)):
     # Resolve user name for display
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
-    user_name = user.get("name") if user else None
-    feedback = {
+    user = await loaders.users.load(user_id)
+    await db.reviews.insert_one({
+        "entity_type": entity_type,
+        "entity_id": ObjectId(entity_id),
         "user_id": ObjectId(user_id),
-        "user_name": user_name,
-        "rating": feedback_data.get("rating", 0),
+        "user_name": user.get("name") if user else None,
+        "rating": rating or 0,
         "comment": feedback_data.get("comment", ""),
         "created_at": datetime.utcnow()
-    }
-    
-    result = await db.materials.update_one(
-        {"_id": ObjectId(material_id)},
-        {"$push": {"feedback": feedback}}
-    )
-    
-    if result.modified_count == 0:
+    })
+    mark_collection_changed(collection_name, entity_id)
+    return True
+
+async def recent_reviews(entity_type: str, entity_id: ObjectId, limit: int = REVIEWS_EMBED_LIMIT) -> List[dict]:
+    """Newest reviews of one entity, embedded as `feedback` by the detail routes"""
+    cursor = db.reviews.find({"entity_type": entity_type, "entity_id": entity_id}, {"entity_type": 0, "entity_id": 0})
+    return await cursor.sort([("created_at", -1), ("_id", -1)]).limit(limit).to_list(length=limit)
+
+class RatingReconciler:
+    """
+    Rebuilds rating_summary on courses, tests and materials from the reviews
+    collection, one server-side aggregation ($merge) per entity type. Repairs
+    summaries left behind by a review insert that failed after its summary update;
+    parents with no rated reviews left are reset to the empty summary first.
+    """
+
+    def __init__(self, interval_seconds: int):
+        self.interval_seconds = interval_seconds
+        self.runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @staticmethod
+    def pipeline(entity_type: str, collection_name: str) -> List[dict]:
+        histogram_counts = {f"r{r}": {"$sum": {"$cond": [{"$eq": ["$rating", r]}, 1, 0]}} for r in RATING_VALUES}
+        return [
+            # Only whole-number ratings count, as parse_rating and the feedback migration require
+            {"$match": {"entity_type": entity_type, "rating": {"$in": list(RATING_VALUES)}}},
+            {"$group": {"_id": "$entity_id", "count": {"$sum": 1}, "sum": {"$sum": "$rating"}, **histogram_counts}},
+            {"$project": {"rating_summary": {
+                "count": "$count",
+                "sum": "$sum",
+                "average": {"$round": [{"$divide": ["$sum", "$count"]}, 2]},
+                "histogram": {str(r): f"$r{r}" for r in RATING_VALUES},
+            }}},
+            {"$merge": {"into": collection_name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+        ]
+
+    async def reconcile(self):
+        started = time.perf_counter()
+        for entity_type, collection_name in REVIEW_ENTITY_COLLECTIONS.items():
+            # $merge only reaches parents that still have rated reviews, so reset the rest
+            # first; the $merge then restores any parent rated in between
+            rated = await db.reviews.distinct("entity_id", {"entity_type": entity_type,
+                                                            "rating": {"$in": list(RATING_VALUES)}})
+            await db[collection_name].update_many(
+                {"_id": {"$nin": rated}, "rating_summary.count": {"$gt": 0}},
+                {"$set": {"rating_summary": empty_rating_summary()}}
+            )
+            await db.reviews.aggregate(self.pipeline(entity_type, collection_name)).to_list(length=None)
+            mark_collection_changed(collection_name)
+        self.runs += 1
+        self.last_run_at = datetime.utcnow()
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    async def run(self):
+        """Background loop reconciling rating summaries every interval_seconds"""
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.reconcile()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error reconciling rating summaries: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+        }
+
+rating_reconciler = RatingReconciler(RATING_RECONCILE_INTERVAL_SECONDS)
+
+@app.post("/feedback/material/{material_id}")
+async def add_material_feedback(material_id: str, feedback_data: dict, user_id: str = Depends(get_current_user),
+                                loaders: RequestLoaders = Depends()):
+    if not await add_review("material", material_id, user_id, feedback_data, loaders):
         raise HTTPException(status_code=404, detail="Material not found")
-    
     return {"message": "Feedback added successfully"}
 
 @app.post("/feedback/test/{test_id}")
-async def add_test_feedback(test_id: str, feedback_data: dict, user_id: str = Depends(get_current_user)):
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
-    user_name = user.get("name") if user else None
-    feedback = {
-        "user_id": ObjectId(user_id),
-        "user_name": user_name,
-        "rating": feedback_data.get("rating", 0),
-        "comment": feedback_data.get("comment", ""),
-        "created_at": datetime.utcnow()
-    }
-    
-    result = await db.online_tests.update_one(
-        {"_id": ObjectId(test_id)},
-        {"$push": {"feedback": feedback}}
-    )
-    
-    if result.modified_count == 0:
+async def add_test_feedback(test_id: str, feedback_data: dict, user_id: str = Depends(get_current_user),
+                            loaders: RequestLoaders = Depends()):
+    if not await add_review("test", test_id, user_id, feedback_data, loaders):
         raise HTTPException(status_code=404, detail="Test not found")
-    
     return {"message": "Feedback added successfully"}
 
 @app.post("/feedback/course/{course_id}")
-async def add_course_feedback(course_id: str, feedback_data: dict, user_id: str = Depends(get_current_user)):
-    """
-    Add feedback for a course directly on the course document (no enrollment required).
-    Stored structure mirrors material feedback: { user_id, rating, comment, created_at }.
-    """
-    # Validate course exists
-    course = await db.courses.find_one({"_id": ObjectId(course_id)})
-    if not course:
+async def add_course_feedback(course_id: str, feedback_data: dict, user_id: str = Depends(get_current_user),
+                              loaders: RequestLoaders = Depends()):
+    """Add feedback for a course (no enrollment required)"""
+    if not await add_review("course", course_id, user_id, feedback_data, loaders):
         raise HTTPException(status_code=404, detail="Course not found")
-
-    # Build feedback entry
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
-    user_name = user.get("name") if user else None
-    feedback = {
-        "user_id": ObjectId(user_id),
-        "user_name": user_name,
-        "rating": feedback_data.get("rating", 0),
-        "comment": feedback_data.get("comment", ""),
-        "created_at": datetime.utcnow(),
-    }
-
-    result = await db.courses.update_one(
-        {"_id": ObjectId(course_id)},
-        {"$push": {"feedback": feedback}, "$set": {"updated_at": datetime.utcnow()}}
-    )
-
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to add course feedback")
-
     return {"message": "Course feedback added successfully"}
 
+@app.get("/reviews")
+async def get_reviews(entity_type: str, entity_id: str, page: PageParams = Depends(),
+                      stream: bool = Depends(wants_ndjson)):
+    """Reviews of one course, test or material, newest first"""
+    if entity_type not in REVIEW_ENTITY_COLLECTIONS:
+        raise HTTPException(status_code=400, detail="entity_type must be one of: course, test, material")
+    query = {"entity_type": entity_type, "entity_id": ObjectId(entity_id)}
+    if stream:
+        return stream_documents(db.reviews, query, page, sort_field="created_at", direction=-1)
+    reviews, next_cursor = await fetch_page(db.reviews, query, page, sort_field="created_at", direction=-1)
+    return page_response("reviews", reviews, next_cursor, page)
+
 # =============== PAYMENTS (RAZORPAY) ===============
 
 @app.post("/payments/razorpay/link")
@@ -2190,7 +4333,7 @@ async def razorpay_payment_status(payload: RazorpayStatusRequest):
     return {"payment_id": payload.payment_id, **status_info}
 
 @app.get("/payments/history/{user_id}")
-async def get_payment_history(user_id: str):
+async def get_payment_history(user_id: str, page: PageParams = Depends(), fields: Optional[str] = None):
     """
     Get all payment history for a user from our database.
     """
@@ -2201,10 +4344,12 @@ async def get_payment_history(user_id: str):
     except:
         user_query = {"user_id": user_id}
     
-    # Get payment links created by this user
-    payment_links = []
-    async for link in db.payment_links.find(user_query).sort("created_at", -1):
-        payment_links.append(serialize_object(link))
+    # Get payment links created by this user; the status join needs link_id/payment_id
+    # even when ?fields= leaves them out
+    projection, join_keys = projection_with(read_projection("payment_links", fields, for_list=True),
+                                            ["link_id", "payment_id"])
+    payment_links, next_cursor = await fetch_page(db.payment_links, user_query, page, sort_field="created_at",
+                                                  direction=-1, projection=projection)
     
     # Get payment status records for this user (join by payment_id in links)
     payment_statuses = []
@@ -2212,28 +4357,39 @@ async def get_payment_history(user_id: str):
         pid = link.get("link_id") or link.get("payment_id")
         if not pid:
             continue
-        status = await db.payment_status.find_one({"payment_id": pid})
+        status = await db.payment_status.find_one({"payment_id": pid}, read_projection("payment_status", for_list=True))
         if status:
-            payment_statuses.append(serialize_object(status))
+            payment_statuses.append(status)
+    for link in payment_links:
+        for key in join_keys:
+            link.pop(key, None)
     
-    return {
+    response = {
         "user_id": user_id,
         "payment_links": payment_links,
         "payment_statuses": payment_statuses
     }
+    if page.paginated:
+        response["next_cursor"] = next_cursor
+    return response
 
 @app.get("/payments/history")
 async def get_all_payment_history(
-    limit: int = 100,
-    offset: int = 0,
+    limit: int = Query(100, ge=1, le=LIST_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
     status: Optional[str] = None,
     product_type: Optional[str] = None,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    stream: bool = Depends(wants_ndjson)
 ):
     """
     Get all payment history from the database (not user-specific).
     Supports filtering by status, product_type, and date range.
+    Pass the returned next_cursor as `after` to page without skip/offset.
+    Streaming (NDJSON) exports every matching record, ignoring limit/offset.
     """
     # Build filter query
     filter_query = {}
@@ -2254,10 +4410,22 @@ async def get_all_payment_history(
             date_filter["$lte"] = end_dt
         filter_query["created_at"] = date_filter
     
-    # Get payment links with filters
-    payment_links = []
-    async for link in db.payment_links.find(filter_query).sort("created_at", -1).skip(offset).limit(limit):
-        payment_links.append(serialize_object(link))
+    # Get payment links with filters; a cursor replaces offset-based skipping
+    projection = read_projection("payment_links", fields, for_list=True)
+    if stream:
+        return stream_documents(db.payment_links, filter_query, PageParams(after=after), sort_field="created_at",
+                                direction=-1, projection=projection)
+    if after:
+        payment_links, next_cursor = await fetch_page(
+            db.payment_links, filter_query, PageParams(after=after, limit=limit),
+            sort_field="created_at", direction=-1, projection=projection
+        )
+    else:
+        if not projection_includes(projection, "created_at"):
+            projection = {**projection, "created_at": 1}
+        payment_links = await db.payment_links.find(filter_query, projection).sort([("created_at", -1), ("_id", -1)]) \
+            .skip(offset).limit(limit).to_list(length=limit)
+        next_cursor = encode_cursor(payment_links[-1], "created_at") if len(payment_links) == limit else None
     
     # Get total count for pagination
     total_count = await db.payment_links.count_documents(filter_query)
@@ -2267,6 +4435,7 @@ async def get_all_payment_history(
         "total_count": total_count,
         "limit": limit,
         "offset": offset,
+        "next_cursor": next_cursor,
         "filters": {
             "status": status,
             "product_type": product_type,
@@ -2368,17 +4537,18 @@ async def create_carousel_item(image: UploadFile = File(...)):
         "updated_at": datetime.utcnow()
     }
     result = await db.carousel.insert_one(item)
+    mark_collection_changed("carousel")
     return {"message": "Carousel item created", "id": str(result.inserted_id)}
 
 @app.get("/carousel")
-async def get_carousel_items():
-    items = []
-    async for it in db.carousel.find().sort("created_at", -1):
-        # Normalize fields for frontend contract
-        if "image_url" not in it:
-            it["image_url"] = ""
-        items.append(serialize_object({"_id": it.get("_id"), "image_url": it.get("image_url"), "created_at": it.get("created_at"), "updated_at": it.get("updated_at")}))
-    return {"items": items}
+async def get_carousel_items(page: PageParams = Depends()):
+    items, next_cursor = await fetch_page(db.carousel, {}, page, sort_field="created_at", direction=-1)
+    # Normalize fields for frontend contract
+    items = [
+        {"_id": it.get("_id"), "image_url": it.get("image_url", ""), "created_at": it.get("created_at"), "updated_at": it.get("updated_at")}
+        for it in items
+    ]
+    return page_response("items", items, next_cursor, page)
 
 @app.delete("/carousel/{item_id}")
 async def delete_carousel_item(item_id: str):
@@ -2395,6 +4565,7 @@ async def delete_carousel_item(item_id: str):
     result = await db.carousel.delete_one({"_id": ObjectId(item_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Carousel item not found")
+    mark_collection_changed("carousel")
     return {"message": "Carousel item deleted"}
 
 # =============== YOUTUBE VIDEO ROUTES ===============
@@ -2410,20 +4581,20 @@ async def create_youtube_video(video: YouTubeVideoCreate):
         "updated_at": datetime.utcnow(),
     }
     result = await db.youtube_videos.insert_one(item)
+    mark_collection_changed("youtube_videos")
     return {"message": "YouTube video saved", "id": str(result.inserted_id)}
 
 @app.get("/youtube")
-async def get_youtube_videos():
-    items = []
-    async for it in db.youtube_videos.find().sort("created_at", -1):
-        items.append(serialize_object(it))
-    return {"videos": items}
+async def get_youtube_videos(page: PageParams = Depends()):
+    items, next_cursor = await fetch_page(db.youtube_videos, {}, page, sort_field="created_at", direction=-1)
+    return page_response("videos", items, next_cursor, page)
 
 @app.delete("/youtube/{video_id}")
 async def delete_youtube_video(video_id: str):
     result = await db.youtube_videos.delete_one({"_id": ObjectId(video_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="YouTube video not found")
+    mark_collection_changed("youtube_videos")
     return {"message": "YouTube video deleted"}
 
 # =============== TEXT SLIDER ROUTES ===============
@@ -2437,14 +4608,13 @@ async def create_text_slider(item: TextSliderCreate):
         "updated_at": datetime.utcnow(),
     }
     result = await db.text_slider.insert_one(record)
+    mark_collection_changed("text_slider")
     return {"message": "Text added", "id": str(result.inserted_id)}
 
 @app.get("/text-slider")
-async def get_text_slider():
-    items = []
-    async for it in db.text_slider.find().sort("created_at", -1):
-        items.append(serialize_object(it))
-    return {"items": items}
+async def get_text_slider(page: PageParams = Depends()):
+    items, next_cursor = await fetch_page(db.text_slider, {}, page, sort_field="created_at", direction=-1)
+    return page_response("items", items, next_cursor, page)
 
 @app.put("/text-slider/{item_id}")
 async def update_text_slider(item_id: str, data: dict):
@@ -2452,6 +4622,7 @@ async def update_text_slider(item_id: str, data: dict):
     result = await db.text_slider.update_one({"_id": ObjectId(item_id)}, {"$set": data})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Text item not found")
+    mark_collection_changed("text_slider")
     return {"message": "Text updated"}
 
 @app.delete("/text-slider/{item_id}")
@@ -2459,6 +4630,7 @@ async def delete_text_slider(item_id: str):
     result = await db.text_slider.delete_one({"_id": ObjectId(item_id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Text item not found")
+    mark_collection_changed("text_slider")
     return {"message": "Text deleted"}
 
 # =============== BULK OPERATIONS ROUTES ===============
@@ -2487,7 +4659,6 @@ async def bulk_create_materials(materials_data: List[MaterialCreate]):
             **material.dict(),
             "download_count": 0,
             "tags": [],
-            "feedback": [],
             "is_active": True,
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
@@ -2495,19 +4666,205 @@ async def bulk_create_materials(materials_data: List[MaterialCreate]):
         materials_list.append(material_dict)
     
     result = await db.materials.insert_many(materials_list)
+    mark_collection_changed("materials", *result.inserted_ids)
     return {"message": f"{len(result.inserted_ids)} materials created successfully"}
 
-# =============== STARTUP EVENT ===============
+# =============== ADMIN RUNTIME METRICS ===============
+
+@app.get("/admin/metrics")
+async def get_runtime_metrics():
+    """In-process cache, buffer and worker pool statistics for this API worker"""
+    return {
+        "session_cache": session_cache.stats(),
+        "session_activity": session_activity_buffer.stats(),
+        "counters": counter_aggregator.stats(),
+        "sharded_counters": sharded_counters.stats(),
+        "catalog_search": catalog_search.stats(),
+        "search_suggestions": suggest_index.stats(),
+        "password_hashing": password_hasher.stats(),
+        "google_jwks": google_jwks_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "response_compression": compression_stats.stats(),
+        "rating_reconciler": rating_reconciler.stats(),
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
+@app.post("/admin/ratings/reconcile")
+async def reconcile_ratings():
+    """Rebuild every rating_summary from the reviews collection now"""
+    await rating_reconciler.reconcile()
+    return {"message": "Rating summaries reconciled", "reconciler": rating_reconciler.stats()}
+
+@app.get("/admin/sessions/stats")
+async def get_session_stats():
+    """Session table sizes and sweeper statistics"""
+    async def storage_stats(collection) -> Dict[str, Any]:
+        try:
+            stats = await db.command("collStats", collection.name)
+            return {"size_bytes": stats.get("size", 0), "index_size_bytes": stats.get("totalIndexSize", 0)}
+        except Exception:
+            return {}
+
+    total_sessions = await db.user_sessions.estimated_document_count()
+    active_sessions = await db.user_sessions.count_documents({"is_active": True})
+    return {
+        "user_sessions": {
+            "total": total_sessions,
+            "active": active_sessions,
+            "ended_awaiting_sweep": max(0, total_sessions - active_sessions),
+            **(await storage_stats(db.user_sessions))
+        },
+        "user_session_history": {
+            "total": await db.user_session_history.estimated_document_count(),
+            "retention_days": SESSION_HISTORY_RETENTION_DAYS,
+            **(await storage_stats(db.user_session_history))
+        },
+        "sweeper": session_sweeper.stats(),
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
+# =============== DATABASE INDEXES ===============
+
+async def ensure_indexes():
+    """
+    Create the indexes the hot paths rely on. Failures are logged rather than
+    raised so the API still starts against a database with conflicting data.
+    """
+    index_specs = [
+        # At most one active session per user; login rotation upserts against it
+        (db.user_sessions, [("user_id", 1)], {
+            "name": "one_active_session_per_user",
+            "unique": True,
+            "partialFilterExpression": {"is_active": True}
+        }),
+        # Session validation, activity flushes and refresh all match on these fields
+        (db.user_sessions, [("user_id", 1), ("session_id", 1), ("is_active", 1)], {
+            "name": "user_session_active"
+        }),
+        # Lets the sweeper find ended sessions without scanning active ones
+        (db.user_sessions, [("ended_at", 1)], {
+            "name": "ended_sessions",
+            "partialFilterExpression": {"is_active": False}
+        }),
+        (db.user_session_history, [("user_id", 1), ("ended_at", -1)], {
+            "name": "user_ended_at"
+        }),
+        (db.user_session_history, [("ended_at", 1)], {
+            "name": "history_retention_ttl",
+            "expireAfterSeconds": SESSION_HISTORY_RETENTION_DAYS * 86400
+        }),
+        # /reviews pages and the detail routes' embedded feedback read this order
+        (db.reviews, [("entity_type", 1), ("entity_id", 1), ("created_at", -1), ("_id", -1)], {
+            "name": "entity_reviews_newest"
+        }),
+        # track_download upserts against this key, so concurrent taps cannot duplicate rows
+        (db.user_downloads, [("user_id", 1), ("material_id", 1)], {
+            "name": "unique_user_material_download",
+            "unique": True
+        }),
+        # enroll_user_in_course upserts against this key
+        (db.user_enrollments, [("user_id", 1), ("course_id", 1)], {
+            "name": "unique_user_course_enrollment",
+            "unique": True
+        }),
+        # /search: one weighted text index per collection (titles outrank descriptions),
+        # plus equality indexes for the filters used without a query
+        (db.courses, [("name", "text"), ("title", "text"), ("description", "text")], {
+            "name": "course_search",
+            "weights": {"name": 10, "title": 10, "description": 2}
+        }),
+        (db.materials, [("title", "text"), ("sub_category", "text"), ("description", "text")], {
+            "name": "material_search",
+            "weights": {"title": 10, "sub_category": 5, "description": 2}
+        }),
+        (db.online_tests, [("test_title", "text"), ("subject", "text"), ("description", "text")], {
+            "name": "test_search",
+            "weights": {"test_title": 10, "subject": 5, "description": 2}
+        }),
+        (db.courses, [("category", 1)], {"name": "category"}),
+        (db.materials, [("course", 1), ("sub_category", 1)], {"name": "course_sub_category"}),
+        (db.materials, [("sub_category", 1)], {"name": "sub_category"}),
+        (db.online_tests, [("subject", 1), ("difficulty_level", 1)], {"name": "subject_difficulty"}),
+        (db.online_tests, [("difficulty_level", 1)], {"name": "difficulty_level"}),
+        # One document per counter shard; reads group every shard of a (collection, field)
+        (db.counter_shards, [("collection", 1), ("field", 1), ("entity_id", 1), ("shard", 1)], {
+            "name": "counter_shard",
+            "unique": True
+        }),
+        # ?sort=rating and ?min_rating= on catalog lists and search
+        *[(db[name], [("rating_summary.average", -1), ("_id", -1)], {"name": "rating_average"})
+          for name in REVIEW_ENTITY_COLLECTIONS.values()],
+        # Google sign-in finds users by email or firebase_uid in one upsert
+        (db.users, [("email", 1)], {"name": "unique_email", "unique": True}),
+        (db.users, [("firebase_uid", 1)], {
+            "name": "unique_firebase_uid",
+            "unique": True,
+            "partialFilterExpression": {"firebase_uid": {"$type": "string"}}
+        }),
+    ]
+    for collection, keys, options in index_specs:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            print(f"Failed to create index {options.get('name')} on {collection.name}: {str(e)}")
+
+# =============== STARTUP / SHUTDOWN EVENTS ===============
 
 @app.on_event("startup")
 async def startup_event():
     """
     Start background tasks when the application starts
     """
+    await ensure_indexes()
+
     # Start payment polling task
-    asyncio.create_task(poll_payment_status())
+    background_loops.append(spawn_background(poll_payment_status(), name="poll_payment_status"))
     print("Payment polling background task started")
 
+    # Start session activity write-behind task
+    background_loops.append(spawn_background(session_activity_buffer.run(), name="session_activity_buffer.run"))
+    print("Session activity flush task started")
+
+    # Start view/download counter write-behind task
+    background_loops.append(spawn_background(counter_aggregator.run(), name="counter_aggregator.run"))
+    print("Counter flush task started")
+
+    # Build the in-memory catalog search index and rebuild it periodically
+    background_loops.append(spawn_background(catalog_search.run(), name="catalog_search.run"))
+    print("Catalog search index builder started")
+
+    # Build search suggestions and rebuild them periodically
+    background_loops.append(spawn_background(suggest_index.run(), name="suggest_index.run"))
+    print("Search suggestion builder started")
+
+    # Start ended-session sweeper
+    background_loops.append(spawn_background(session_sweeper.run(), name="session_sweeper.run"))
+    print("Session sweeper background task started")
+
+    # Start rating summary reconciliation
+    background_loops.append(spawn_background(rating_reconciler.run(), name="rating_reconciler.run"))
+    print("Rating reconciler background task started")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Stop the background loops, then flush write-behind buffers before the application stops
+    """
+    for task in background_loops:
+        task.cancel()
+    await asyncio.gather(*background_loops, return_exceptions=True)
+    background_loops.clear()
+    try:
+        flushed = await session_activity_buffer.flush()
+        print(f"Flushed {flushed} session activity updates")
+    except Exception as e:
+        print(f"Error flushing session activity on shutdown: {str(e)}")
+    try:
+        flushed = await counter_aggregator.flush()
+        print(f"Flushed {flushed} counter updates")
+    except Exception as e:
+        print(f"Error flushing counters on shutdown: {str(e)}")
+
 # =============== RUN SERVER ===============
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+One-time migration of embedded feedback arrays into the reviews collection
+
+Moves every `feedback` entry on courses, online_tests and materials into
+`reviews`, rebuilds the parent's rating_summary (count, sum, average and
+1-5 histogram) from the reviews collection and unsets the array. Each
+entry is upserted on a legacy_key of the parent _id and its array index,
+so the script can be re-run safely after an interruption, and the array
+is only unset once every entry is accounted for in `reviews`.
+
+Usage: python migrate_feedback_to_reviews.py [--dry-run]
+"""
+
+import os
+import sys
+
+from pymongo import MongoClient, UpdateOne
+
+# Settings (align with backend/main.py)
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "vidyarthi_mitraa")
+
+ENTITY_COLLECTIONS = {"course": "courses", "test": "online_tests", "material": "materials"}
+# Ratings counted in rating_summary; main.py only accepts whole numbers 1-5
+RATING_VALUES = [1, 2, 3, 4, 5]
+
+
+def review_upserts(entity_type, parent):
+    for index, entry in enumerate(parent.get("feedback") or []):
+        if not isinstance(entry, dict):
+            # Keep bare legacy values as a comment rather than dropping them
+            entry = {"comment": str(entry)}
+        review = {
+            "entity_type": entity_type,
+            "entity_id": parent["_id"],
+            "user_id": entry.get("user_id"),
+            "user_name": entry.get("user_name"),
+            "rating": entry.get("rating", 0),
+            "comment": entry.get("comment", ""),
+            "created_at": entry.get("created_at") or entry.get("feedback_date") or parent.get("created_at"),
+        }
+        yield UpdateOne({"legacy_key": f"{parent['_id']}:{index}"}, {"$setOnInsert": review}, upsert=True)
+
+
+def rating_summary(db, entity_type, entity_id):
+    # Same shape main.py maintains; legacy ratings that are not whole numbers 1-5 are not counted
+    histogram = {str(r): 0 for r in RATING_VALUES}
+    pipeline = [
+        {"$match": {"entity_type": entity_type, "entity_id": entity_id, "rating": {"$in": RATING_VALUES}}},
+        {"$group": {"_id": "$rating", "count": {"$sum": 1}}},
+    ]
+    for bucket in db.reviews.aggregate(pipeline):
+        histogram[str(int(bucket["_id"]))] += bucket["count"]
+    count = sum(histogram.values())
+    total = sum(int(r) * n for r, n in histogram.items())
+    return {
+        "count": count,
+        "sum": total,
+        "average": round(total / count, 2) if count else None,
+        "histogram": histogram,
+    }
+
+
+def migrate(db, dry_run=False):
+    if not dry_run:
+        db.reviews.create_index("legacy_key", name="legacy_key", unique=True,
+                                partialFilterExpression={"legacy_key": {"$type": "string"}})
+    for entity_type, collection_name in ENTITY_COLLECTIONS.items():
+        collection = db[collection_name]
+        parents = reviews = skipped = 0
+        for parent in collection.find({"feedback": {"$exists": True}}, {"feedback": 1, "created_at": 1}):
+            upserts = list(review_upserts(entity_type, parent))
+            if not dry_run and upserts:
+                result = db.reviews.bulk_write(upserts, ordered=False)
+                written = result.upserted_count + result.matched_count
+                if written != len(upserts):
+                    # Keep the array so nothing is lost; a re-run picks the parent up again
+                    print(f"{collection_name} {parent['_id']}: only {written} of {len(upserts)} "
+                          f"feedback entries found in reviews, feedback left in place")
+                    skipped += 1
+                    continue
+            parents += 1
+            reviews += len(upserts)
+            if dry_run:
+                continue
+            collection.update_one(
+                {"_id": parent["_id"]},
+                {"$set": {"rating_summary": rating_summary(db, entity_type, parent["_id"])},
+                 "$unset": {"feedback": ""}}
+            )
+        action = "Would move" if dry_run else "Moved"
+        print(f"{collection_name}: {action} {reviews} feedback entries from {parents} documents"
+              + (f", {skipped} documents skipped" if skipped else ""))
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv
+    client = MongoClient(MONGODB_URL)
+    try:
+        migrate(client[DATABASE_NAME], dry_run=dry_run)
+    finally:
+        client.close()